@@ -1,6 +1,12 @@
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
 from pymongo.server_api import ServerApi
 from pymongo.mongo_client import MongoClient
 
+from app.services.idempotency_service import IDEMPOTENCY_KEY_TTL_SECONDS
+from app.services.profiling_service import profiling_listener
+from app.services.rate_limit_service import in_flight_counter
+
 import os
 from dotenv import load_dotenv
 
@@ -8,7 +14,8 @@ load_dotenv()
 
 MONGO_URI = os.getenv('MONGO_URI')
 # Create a new client and connect to the server
-client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
+client = MongoClient(MONGO_URI, server_api=ServerApi('1'),
+                     event_listeners=[in_flight_counter, profiling_listener])
 try:
     client.admin.command('ping')
     print("Pinged your deployment. You successfully connected to MongoDB!")
@@ -20,3 +27,70 @@ db = client["database"]
 
 def get_database():
     return db
+
+
+def create_index(collection, keys, **kwargs):
+    # Mỗi index tạo riêng: một index lỗi (dữ liệu cũ bị trùng) không chặn các index còn lại
+    try:
+        collection.create_index(keys, **kwargs)
+    except Exception as e:
+        print(f"Could not create index {keys} on {collection.name}: {e}")
+
+
+def ensure_indexes(db):
+    # Index cho truy vấn assign/register table theo tuần và theo khoảng tuần
+    create_index(db["tables"], [("table_type", ASCENDING), ("week", ASCENDING)])
+
+    # Index cho export theo khoảng ngày của các ca trong assign table
+    create_index(
+        db["tables"],
+        [("table_type", ASCENDING), ("shifts.date", ASCENDING)])
+
+    # Jobs nền: tra cứu theo job_id và tìm job cần chạy lại khi khởi động
+    create_index(db["jobs"], "job_id", unique=True)
+    create_index(db["jobs"], [("status", ASCENDING), ("updated_at", ASCENDING)])
+
+    # Idempotency-Key: mỗi key chỉ dùng một lần cho mỗi user và endpoint, tự xóa sau TTL
+    create_index(
+        db["idempotency_keys"],
+        [("owner_username", ASCENDING), ("scope", ASCENDING), ("key", ASCENDING)],
+        unique=True
+    )
+    create_index(
+        db["idempotency_keys"],
+        "created_at", expireAfterSeconds=IDEMPOTENCY_KEY_TTL_SECONDS)
+
+    # table_id là khóa mà modify_assign dùng để cập nhật, không được trùng
+    create_index(db["tables"], "table_id", unique=True)
+
+    # Mỗi nhân viên chỉ có một register table cho mỗi tuần của năm
+    create_index(
+        db["tables"],
+        [("user_details.username", ASCENDING),
+         ("year", ASCENDING), ("week", ASCENDING)],
+        unique=True,
+        partialFilterExpression={
+            "table_type": "register", "year": {"$exists": True}}
+    )
+
+    # Mỗi manager (cửa hàng) chỉ có một assign table cho mỗi tuần của năm,
+    # kể cả khi approve/copy đồng thời
+    create_index(
+        db["tables"],
+        [("user_details.username", ASCENDING),
+         ("week", ASCENDING), ("year", ASCENDING)],
+        unique=True,
+        partialFilterExpression={
+            "table_type": "assign", "year": {"$exists": True}}
+    )
+
+    # Username, email và user_id không được trùng
+    create_index(db["users"], "username", unique=True)
+    create_index(db["users"], "email", unique=True)
+    create_index(db["users"], "user_id", unique=True)
+
+
+def is_duplicate_key(error: DuplicateKeyError, field: str) -> bool:
+    # MongoDB 4.4+ trả về keyPattern, bản cũ hơn chỉ có tên index trong errmsg
+    details = error.details or {}
+    return field in details.get("keyPattern", {}) or f"index: {field}_1 " in details.get("errmsg", str(error))
@@ -1,11 +1,41 @@
-
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 
-from app.routers import auth_router, table_router, user_router
+from app.dependencies import ensure_indexes, get_database
+from app.middlewares.compression_middleware import CompressionMiddleware
+from app.middlewares.profiling_middleware import profiling_middleware
+from app.middlewares.rate_limit_middleware import rate_limit_middleware
+from app.routers import auth_router, export_router, job_router, metrics_router, profile_router, table_router, user_router
+from app.services.availability_service import backfill_bitmaps
+from app.services.job_service import resume_pending_jobs, shutdown_executor
+from app.services.table_service import backfill_table_years, seed_table_id_counters
+from app.services.user_service import seed_user_id_counters
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Mỗi bước khởi động chạy độc lập để một bước lỗi không chặn các bước còn lại
+    for startup_task in [ensure_indexes, backfill_bitmaps, backfill_table_years, seed_table_id_counters, seed_user_id_counters, resume_pending_jobs]:
+        try:
+            startup_task(get_database())
+        except Exception as e:
+            print(e)
+    yield
+    shutdown_executor()
+
+
+app = FastAPI(lifespan=lifespan)
 
-app = FastAPI()
+# Middleware thêm sau sẽ bọc bên ngoài: request bị rate limit không được profile
+app.middleware("http")(profiling_middleware)
+app.middleware("http")(rate_limit_middleware)
+app.add_middleware(CompressionMiddleware)
 
 
 app.include_router(auth_router.router, prefix="/auth", tags=["auth"])
 app.include_router(user_router.router, prefix="/users", tags=["users"])
 app.include_router(table_router.router, prefix="/tables", tags=["tables"])
+app.include_router(export_router.router, prefix="/exports", tags=["exports"])
+app.include_router(job_router.router, prefix="/jobs", tags=["jobs"])
+app.include_router(metrics_router.router, prefix="/metrics", tags=["metrics"])
+app.include_router(profile_router.router, prefix="/profiles", tags=["profiles"])
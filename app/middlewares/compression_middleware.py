@@ -0,0 +1,166 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli là tùy chọn, khi không cài thì chỉ dùng gzip
+    brotli = None
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class GzipCompressor:
+    def __init__(self):
+        self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+COMPRESSORS = {"gzip": GzipCompressor}
+if brotli is not None:
+    COMPRESSORS["br"] = BrotliCompressor
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    # Chọn encoding có q cao nhất mà server hỗ trợ, ưu tiên br khi bằng nhau
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    candidates = [
+        (accepted.get(name, accepted.get("*", 0.0)), name == "br", name)
+        for name in COMPRESSORS
+    ]
+    quality, _, name = max(candidates)
+    return name if quality > 0 else None
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MINIMUM_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers", []))
+        encoding = negotiate_encoding(
+            headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = CompressionResponder(send, encoding, self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder:
+    def __init__(self, send, encoding: str, minimum_size: int):
+        self._send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.pending = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            self.passthrough = any(
+                key.lower() == b"content-encoding" for key, _ in message["headers"])
+            if self.passthrough:
+                await self._flush_start()
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self._flush_start()
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            if not more_body:
+                # Toàn bộ body đã có (kể cả khi bị chia thành chunk đầu + chunk rỗng cuối)
+                await self._send_whole_body((self.pending or b"") + body)
+                return
+            if self.pending is None:
+                # Giữ lại chunk đầu để phân biệt response thường với response stream
+                self.pending = body
+                return
+
+            # Response dạng stream (ví dụ export CSV): nén từng chunk, không buffer toàn bộ
+            self.compressor = COMPRESSORS[self.encoding]()
+            self._set_headers(None)
+            await self._flush_start()
+            body = self.pending + body
+            self.pending = None
+
+        chunk = self.compressor.compress(body) if body else b""
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+    async def _send_whole_body(self, body: bytes):
+        if len(body) < self.minimum_size:
+            await self._flush_start()
+            await self._send({"type": "http.response.body", "body": body})
+            return
+
+        # Nén toàn bộ và báo lại kích thước trước/sau khi nén qua header
+        compressor = COMPRESSORS[self.encoding]()
+        compressed = compressor.compress(body) + compressor.finish()
+        self._set_headers(len(compressed), uncompressed_length=len(body))
+        await self._flush_start()
+        await self._send({"type": "http.response.body", "body": compressed})
+
+    def _set_headers(self, content_length: int | None, uncompressed_length: int | None = None):
+        headers = [
+            (key, value) for key, value in self.start_message["headers"]
+            if key.lower() != b"content-length"
+        ]
+        headers.append((b"content-encoding", self.encoding.encode()))
+        headers.append((b"vary", b"Accept-Encoding"))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode()))
+        if uncompressed_length is not None:
+            headers.append((b"x-uncompressed-length",
+                           str(uncompressed_length).encode()))
+        self.start_message["headers"] = headers
+
+    async def _flush_start(self):
+        if self.start_message is not None:
+            await self._send(self.start_message)
+            self.start_message = None
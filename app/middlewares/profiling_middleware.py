@@ -0,0 +1,37 @@
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+
+from app.services.auth_service import decode_access_token, get_bearer_token
+from app.services.profiling_service import PROFILE_HEADER, PROFILING_ENABLED, finish_profile, start_profile
+
+
+async def profiling_middleware(request: Request, call_next):
+    if not PROFILING_ENABLED or not request.headers.get(PROFILE_HEADER):
+        return await call_next(request)
+
+    # Chỉ manager mới được yêu cầu profile, header từ người khác bị bỏ qua
+    token = get_bearer_token(request.headers.get("Authorization"))
+    payload = decode_access_token(token) if token else None
+    if not payload or "manager" not in payload.get("scopes", []):
+        return await call_next(request)
+
+    profile = start_profile(request.method, request.url.path, payload["sub"])
+    try:
+        response = await call_next(request)
+    except Exception:
+        await run_in_threadpool(finish_profile, profile, 500)
+        raise
+
+    response.headers["X-Profile-Id"] = profile.profile_id
+    response.body_iterator = _profiled_body(
+        response.body_iterator, profile, response.status_code)
+    return response
+
+
+async def _profiled_body(body_iterator, profile, status_code: int):
+    # Response dạng stream (export) chỉ kết thúc sau khi gửi hết body
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        await run_in_threadpool(finish_profile, profile, status_code)
@@ -0,0 +1,54 @@
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+
+from app.services.auth_service import decode_access_token, get_bearer_token
+from app.services.rate_limit_service import LOAD_SHED_RETRY_AFTER_SECONDS, check_rate_limits, in_flight_requests, rejection_counters, retry_after_header, should_shed_load
+
+LOGIN_PATH = "/auth/login/"
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    # Khi database quá tải thì từ chối sớm để giữ p99 cho các request đang chạy
+    if should_shed_load():
+        rejection_counters.increment("load_shed")
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Server is busy, please retry later."},
+            headers={"Retry-After": retry_after_header(
+                LOAD_SHED_RETRY_AFTER_SECONDS)}
+        )
+
+    token = get_bearer_token(request.headers.get("Authorization"))
+    payload = decode_access_token(token) if token else None
+    username = payload.get("sub") if payload else None
+    client_ip = request.client.host if request.client else "unknown"
+
+    rejected = check_rate_limits(
+        client_ip, username, is_login=request.url.path.rstrip("/") == LOGIN_PATH.rstrip("/"))
+    if rejected:
+        reason, retry_after = rejected
+        rejection_counters.increment(reason)
+        return JSONResponse(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            content={"detail": "Too many requests, please slow down."},
+            headers={"Retry-After": retry_after_header(retry_after)}
+        )
+
+    in_flight_requests.acquire()
+    try:
+        response = await call_next(request)
+    except Exception:
+        in_flight_requests.release()
+        raise
+
+    response.body_iterator = _counted_body(response.body_iterator)
+    return response
+
+
+async def _counted_body(body_iterator):
+    # Response dạng stream (export) vẫn đọc MongoDB cho đến khi gửi hết body
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        in_flight_requests.release()
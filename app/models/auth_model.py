@@ -1,5 +1,5 @@
 # Model UserForAuthenticate
-from pydantic import BaseModel
+from pydantic import BaseModel, EmailStr, Field
 
 
 class UserForAuthenticate(BaseModel):
@@ -19,3 +19,12 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: str
     scopes: list[str] = []
+
+# Model cho tạo nhiều tài khoản cùng lúc
+
+
+class AccountForCreate(BaseModel):
+    username: str = Field(min_length=5, max_length=50)
+    email: EmailStr
+    password: str = Field(min_length=6, max_length=100)
+    manager: bool = False
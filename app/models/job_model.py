@@ -0,0 +1,27 @@
+from datetime import datetime
+from typing import Any
+from pydantic import BaseModel
+
+
+class JobProgress(BaseModel):
+    done: int = 0
+    total: int = 0
+
+
+class Job(BaseModel):
+    job_id: str
+    job_type: str
+    status: str  # queued | running | retrying | completed | failed
+    owner_username: str
+    progress: JobProgress = JobProgress()
+    attempts: int = 0
+    max_attempts: int
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class JobResult(BaseModel):
+    job_id: str
+    status: str
+    result: Any = None
@@ -29,6 +29,7 @@ class Table(BaseModel):
 
 class RegisterTable(Table):
     table_type: str = 'register'
+    availability_bitmap: int = 0
 
 
 class ModifyHistory(BaseModel):
@@ -36,8 +37,14 @@ class ModifyHistory(BaseModel):
     description: str
 
 
+class EmployeeBitmap(BaseModel):
+    username: str
+    bitmap: int = 0
+
+
 class AssignTable(Table):
     table_type: str = 'assign'
     shifts: list[ShiftForAssign] = []
     employee_usernames: list[str] = []
     modify_history: list[ModifyHistory] = []
+    bitmaps: list[EmployeeBitmap] = []
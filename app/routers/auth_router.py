@@ -1,15 +1,17 @@
 from datetime import timedelta
 from http import HTTPStatus
 from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException, Query, Security, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Security, status
 from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import EmailStr
 
 from app.dependencies import get_database
-from app.models.auth_model import Token
-from app.services.auth_service import create_access_token, get_current_user, get_password_hash, verify_password
-from app.services.user_service import generate_employee_user_id, generate_manager_user_id
+from app.models.auth_model import AccountForCreate, Token
+from app.services.auth_service import create_access_token, get_current_user, verify_password
+from app.services.idempotency_service import run_idempotent
+from app.services.job_service import enqueue_job
+from app.services.user_service import create_user_account
 
 import os
 from dotenv import load_dotenv
@@ -51,68 +53,66 @@ async def create_account(
         email: EmailStr,
         password: Annotated[str, Query(min_length=6, max_length=100)],
         manager: bool = False,
+        idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
         current_user=Security(get_current_user, scopes=["manager"]),
         db=Depends(get_database),
 ):
 
-    # Kiểm tra xem username và email có tồn tại không
-    existing_user = db["users"].find_one({
-        "$or": [
-            {"username": username},
-            {"email": email}
-        ]
-    })
-
-    if existing_user:
-        if existing_user.get("username") == username:
-            raise HTTPException(
-                status_code=400, detail="Username already in use")
-        if existing_user.get("email") == email:
-            raise HTTPException(status_code=400, detail="Email already in use")
-
-    # Tạo user_id mới tùy thuộc vào role
-    if manager:  # Nếu tạo tài khoản Manager
-        new_user_id = await generate_manager_user_id(db)
-        role = "Manager"
-        user = {
-            "user_id": new_user_id,
-            "role": role,
-            "username": username,
-            "password": get_password_hash(password),
-            "first_name": "",
-            "last_name": "",
-            "address": "",
-            "email": email,
-            "phone_number": "",
-            "gender": None
-        }
-    else:  # Nếu tạo tài khoản Employee
-        new_user_id = await generate_employee_user_id(db)
-        role = "Employee"
-        user = {
-            "user_id": new_user_id,
-            "role": role,
-            "username": username,
-            "password": get_password_hash(password),
-            "first_name": "",
-            "last_name": "",
-            "address": "",
-            "email": email,
-            "phone_number": "",
-            "gender": None,
-            "worked_shifts": [],  # Danh sách rỗng cho Employee
-            # Lưu tên Manager tạo tài khoản
-            "manager_username": current_user.username
-        }
-
-    # Chèn user vào MongoDB
-    db["users"].insert_one(user)
-
-    # Trả về thông báo thành công với mã trạng thái HTTP 201 Created
-    return JSONResponse(
-        status_code=HTTPStatus.CREATED,
-        content={
-            "msg": "User created successfully",
-            "user_id": new_user_id
-        }
+    async def handle():
+        new_user_id = await create_user_account(
+            db, username, email, password, manager, current_user.username
+        )
+
+        # Trả về thông báo thành công với mã trạng thái HTTP 201 Created
+        return JSONResponse(
+            status_code=HTTPStatus.CREATED,
+            content={
+                "msg": "User created successfully",
+                "user_id": new_user_id
+            }
+        )
+
+    # Gửi lại cùng Idempotency-Key sẽ nhận lại kết quả cũ mà không hash lại mật khẩu.
+    # Mật khẩu không được đưa vào fingerprint để không lưu lại dưới bất kỳ dạng nào
+    return await run_idempotent(
+        db, idempotency_key, "create_account", current_user.username,
+        {"username": username, "email": email, "manager": manager},
+        handle
+    )
+
+
+@router.post("/create_accounts/")
+async def create_accounts(
+    accounts: list[AccountForCreate],
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
+    current_user=Security(get_current_user, scopes=["manager"]),
+    db=Depends(get_database),
+):
+    if not accounts:
+        raise HTTPException(status_code=400, detail="No accounts to create")
+
+    async def handle():
+        # Hash mật khẩu tốn CPU nên tạo tài khoản hàng loạt luôn chạy trong job nền.
+        # Mật khẩu chỉ được truyền trong bộ nhớ, không lưu vào collection jobs
+        job_id = enqueue_job(
+            db, "create_accounts",
+            {
+                "accounts": [account.model_dump(exclude={"password"}) for account in accounts],
+                "manager_username": current_user.username
+            },
+            current_user.username,
+            secrets={"passwords": {
+                account.username: account.password for account in accounts}}
+        )
+
+        return JSONResponse(
+            status_code=HTTPStatus.ACCEPTED,
+            content={"status": "queued", "job_id": job_id}
+        )
+
+    # Gửi lại cùng Idempotency-Key sẽ nhận lại job_id cũ thay vì tạo job mới
+    return await run_idempotent(
+        db, idempotency_key, "create_accounts", current_user.username,
+        [account.model_dump(exclude={"password"}) for account in accounts],
+        handle
     )
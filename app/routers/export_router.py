@@ -0,0 +1,76 @@
+from datetime import datetime
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Query, Security, status
+from fastapi.responses import StreamingResponse
+
+from app.dependencies import get_database
+from app.models.user_model import ClientUser
+from app.services.auth_service import get_current_user
+from app.services.export_service import build_shift_export_pipeline, stream_shifts_csv, stream_shifts_ics
+
+router = APIRouter()
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ics": "text/calendar; charset=utf-8",
+}
+
+
+def export_shifts(db, start: datetime, end: datetime, export_format: str, filename: str, table_filter: dict | None = None, username: str | None = None):
+    if end <= start:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'end' must be after 'start'."
+        )
+
+    # Một cursor duy nhất cho toàn bộ khoảng thời gian, batch được đọc dần khi stream
+    cursor = db["tables"].aggregate(
+        build_shift_export_pipeline(start, end, table_filter, username),
+        allowDiskUse=True
+    )
+
+    if export_format == "ics":
+        content = stream_shifts_ics(cursor, filename)
+    else:
+        content = stream_shifts_csv(cursor)
+
+    return StreamingResponse(
+        content,
+        media_type=MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}.{export_format}"'
+        }
+    )
+
+
+@router.get("/shifts_me/")
+async def export_personal_shifts(
+    start: datetime,
+    end: datetime,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["employee"])],
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ics)$"),
+    db=Depends(get_database)
+):
+    return export_shifts(
+        db, start, end, export_format,
+        filename=f"shifts_{current_user.username}",
+        username=current_user.username
+    )
+
+
+@router.get("/shifts/")
+async def export_store_shifts(
+    start: datetime,
+    end: datetime,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    export_format: str = Query("csv", alias="format", pattern="^(csv|ics)$"),
+    username: str | None = None,
+    db=Depends(get_database)
+):
+    # Cửa hàng của manager là các assign table do manager đó tạo
+    return export_shifts(
+        db, start, end, export_format,
+        filename=f"store_shifts_{current_user.username}",
+        table_filter={"user_details.username": current_user.username},
+        username=username
+    )
@@ -0,0 +1,75 @@
+from typing import Annotated
+from fastapi import APIRouter, Depends, HTTPException, Security, status
+from fastapi.responses import JSONResponse
+
+from app.dependencies import get_database
+from app.models.job_model import Job, JobResult
+from app.models.user_model import ClientUser
+from app.services.auth_service import get_current_user
+from app.services.job_service import retry_job
+
+router = APIRouter()
+
+
+def get_owned_job(db, job_id: str, current_user: ClientUser, projection: dict) -> dict:
+    job = db["jobs"].find_one(
+        {"job_id": job_id, "owner_username": current_user.username},
+        projection={"_id": 0, **projection}
+    )
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Job not found."
+        )
+    return job
+
+
+@router.get("/{job_id}/", response_model=Job)
+async def get_job_status(
+    job_id: str,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    db=Depends(get_database)
+):
+    return get_owned_job(db, job_id, current_user, {"payload": 0, "result": 0})
+
+
+@router.get("/{job_id}/result/", response_model=JobResult)
+async def get_job_result(
+    job_id: str,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    db=Depends(get_database)
+):
+    job = get_owned_job(db, job_id, current_user, {
+                        "job_id": 1, "status": 1, "result": 1, "error": 1})
+
+    if job["status"] == "failed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job failed: {job.get('error')}"
+        )
+    if job["status"] != "completed":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job is not finished yet (status: '{job['status']}')."
+        )
+    return job
+
+
+@router.post("/{job_id}/retry/")
+async def retry_failed_job(
+    job_id: str,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    db=Depends(get_database)
+):
+    get_owned_job(db, job_id, current_user, {"job_id": 1})
+
+    if not retry_job(db, job_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Only failed jobs can be retried."
+        )
+
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"msg": "Job queued for retry", "job_id": job_id}
+    )
@@ -0,0 +1,22 @@
+from typing import Annotated
+from fastapi import APIRouter, Security
+
+from app.models.user_model import ClientUser
+from app.services.auth_service import get_current_user
+from app.services.rate_limit_service import LOAD_SHED_MAX_INFLIGHT_DB_OPS, LOAD_SHED_MAX_INFLIGHT_REQUESTS, in_flight_counter, in_flight_requests, rejection_counters
+
+router = APIRouter()
+
+
+@router.get("/admission/")
+async def get_admission_metrics(
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+):
+    return {
+        "in_flight_requests": in_flight_requests.in_flight,
+        "in_flight_requests_threshold": LOAD_SHED_MAX_INFLIGHT_REQUESTS,
+        "in_flight_db_operations": in_flight_counter.in_flight,
+        "load_shed_threshold": LOAD_SHED_MAX_INFLIGHT_DB_OPS,
+        # Số request bị từ chối theo lý do kể từ khi worker khởi động
+        "rejected_requests": rejection_counters.snapshot()
+    }
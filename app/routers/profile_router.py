@@ -0,0 +1,36 @@
+from typing import Annotated
+from fastapi import APIRouter, HTTPException, Security, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+
+from app.models.user_model import ClientUser
+from app.services.auth_service import get_current_user
+from app.services.profiling_service import PROFILING_ENABLED, REPORT_KINDS, get_report_path, list_reports
+
+router = APIRouter()
+
+
+@router.get("/")
+async def get_profiles(
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+):
+    return {
+        "enabled": PROFILING_ENABLED,
+        "profiles": await run_in_threadpool(list_reports)
+    }
+
+
+@router.get("/{profile_id}/{kind}")
+async def download_profile(
+    profile_id: str,
+    kind: str,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+):
+    path = get_report_path(profile_id, kind)
+    if path is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profile not found"
+        )
+
+    return FileResponse(path, media_type=REPORT_KINDS[kind], filename=path.name)
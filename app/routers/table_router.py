@@ -1,16 +1,38 @@
 from datetime import datetime, timezone
 from typing import Annotated
-from fastapi import APIRouter, Body, Depends, HTTPException, Path, Security, status
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Path, Query, Security, status
 from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
 
 from app.dependencies import get_database
-from app.models.table_model import AssignTable, ModifyHistory, RegisterTable, Shift
+from app.models.table_model import AssignTable, EmployeeBitmap, ModifyHistory, RegisterTable, Shift, ShiftForAssign
 from app.models.user_model import ClientUser, ShiftForEmployee
 from app.services.auth_service import get_current_user
-from app.services.table_service import generate_table_id
+from app.services.availability_service import SHIFT_NAMES, build_assign_bitmaps, count_slots, describe_slot, get_slot, shifts_to_bitmap
+from app.services.cache_service import assign_table_cache
+from app.services.idempotency_service import run_idempotent
+from app.services.job_service import enqueue_job
+from app.services.table_service import MAX_WEEK_NUMBER, approve_worked_shift, build_fields_projection, build_week_range_pipeline, collect_usernames, copy_assign_table, create_assign_table, generate_table_id, get_assign_table, get_current_week, insert_table, validate_assignments
+from app.services.user_service import UserLoader, get_user_loader
 
 router = APIRouter()
 
+# Giới hạn số tuần trong một truy vấn range
+MAX_WEEK_RANGE = 53
+
+
+def validate_week_range(from_week: int, to_week: int):
+    if from_week > to_week:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="'from' week must not be after 'to' week."
+        )
+    if to_week - from_week + 1 > MAX_WEEK_RANGE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A range can span at most {MAX_WEEK_RANGE} weeks."
+        )
+
 
 @router.post("/submit_register_table/")
 async def submit_register_table(
@@ -48,19 +70,6 @@ async def submit_register_table(
     # Tính số tuần kể từ đầu năm
     week_number = ((current_date_naive - year_start).days // 7) + 1
 
-    # Kiểm tra xem register table đã tồn tại cho tuần này chưa
-    existing_register = db["tables"].find_one({
-        "table_type": "register",
-        # Sử dụng week_number thay vì yêu cầu người dùng nhập
-        "week": week_number,
-        "user_details.username": current_user.username
-    })
-    if existing_register:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Register table for this week already exists."
-        )
-
     # Tạo table_id mới cho register table (dạng TRxxx)
     table_id = generate_table_id(db, "register")
 
@@ -73,15 +82,25 @@ async def submit_register_table(
         "table_type": "register",
         "week": week_number,  # Tự động thêm tuần
         "date": current_date,  # Tự động thêm ngày hiện tại
+        "year": current_date.year,
         "user_details": {
             "user_id": current_user.user_id,
             "username": current_user.username
         },
-        "shifts": shifts_dict
+        "shifts": shifts_dict,
+        # Bitmap ngày x ca để truy vấn nhanh ai rảnh vào ca nào
+        "availability_bitmap": shifts_to_bitmap(shifts_dict)
     }
 
-    # Chèn register table vào MongoDB
-    db["tables"].insert_one(register_table)
+    # Chèn register table vào MongoDB. Unique index (username, year, week) đảm bảo
+    # mỗi tuần chỉ có một register table, kể cả khi hai request gửi cùng lúc
+    try:
+        table_id = insert_table(db, register_table)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Register table for this week already exists."
+        )
 
     return JSONResponse(
         status_code=status.HTTP_201_CREATED,
@@ -95,8 +114,13 @@ async def submit_register_table(
 @router.get("/week_register_tables/")
 async def get_register_tables_by_week(
     current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    fields: str | None = None,
+    expand: str | None = Query(None, pattern="^users$"),
+    user_loader: UserLoader = Depends(get_user_loader),
     db=Depends(get_database)
 ):
+    projection = build_fields_projection(fields)
+
     # Giả sử current_date có múi giờ (offset-aware datetime)
     current_date = datetime.now(timezone.utc)  # Có thể có timezone info
 
@@ -111,72 +135,171 @@ async def get_register_tables_by_week(
     register_tables = db["tables"].find({
         "table_type": "register",
         "week": week_number
-    })
-
-    result = []
-    for register_table in register_tables:
-        result.append(RegisterTable(**register_table))
+    }, projection=projection)
+
+    register_tables = list(register_tables)
+
+    # Khi chỉ lấy một số field thì trả về dict, không dựng lại model đầy đủ
+    if projection:
+        result = register_tables
+    else:
+        result = []
+        for register_table in register_tables:
+            result.append(RegisterTable(**register_table))
+
+    # Trả kèm thông tin user của mọi username được tham chiếu, lấy bằng một truy vấn
+    if expand == "users":
+        return {
+            "register_tables": result,
+            "users": user_loader.load_many(collect_usernames(register_tables))
+        }
 
     return result
 
 
+@router.get("/register_tables_range/")
+async def get_register_tables_by_week_range(
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    from_week: int = Query(..., alias="from", ge=1),
+    to_week: int = Query(..., alias="to", ge=1),
+    year: int | None = Query(None, ge=1),
+    shift_name: str | None = None,
+    fields: str | None = None,
+    expand: str | None = Query(None, pattern="^users$"),
+    user_loader: UserLoader = Depends(get_user_loader),
+    db=Depends(get_database)
+):
+    validate_week_range(from_week, to_week)
+    projection = build_fields_projection(fields, required={"week"})
+    # Mặc định là năm hiện tại
+    year = year or get_current_week()[1]
+
+    # Một truy vấn duy nhất cho cả khoảng tuần, sau đó nhóm theo tuần
+    register_tables = db["tables"].aggregate(build_week_range_pipeline(
+        "register", from_week, to_week, year, shift_name=shift_name, projection=projection))
+
+    register_tables = list(register_tables)
+
+    weeks = {week: [] for week in range(from_week, to_week + 1)}
+    for register_table in register_tables:
+        weeks[register_table["week"]].append(
+            register_table if projection else RegisterTable(**register_table))
+
+    response = {
+        "from": from_week,
+        "to": to_week,
+        "year": year,
+        "weeks": [{"week": week, "register_tables": tables} for week, tables in weeks.items()]
+    }
+    if expand == "users":
+        response["users"] = user_loader.load_many(
+            collect_usernames(register_tables))
+    return response
+
+
 @router.post("/approve_assign_table/")
 async def approve_assign_table(
     shifts: list[Shift],
     current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    background: bool = False,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
     db=Depends(get_database)
 ):
-    # Tạo table_id mới cho assign table
-    table_id = generate_table_id(db, "assign")
-
-    # Giả sử current_date có múi giờ (offset-aware datetime)
-    current_date = datetime.now(timezone.utc)  # Có thể có timezone info
-
-    # year_start là ngày đầu tiên của năm, giả sử không có múi giờ (offset-naive datetime)
-    year_start = datetime(current_date.year, 1, 1)
+    shifts_dict = [shift.model_dump() for shift in shifts]
+    manager = {
+        "user_id": current_user.user_id,
+        "username": current_user.username
+    }
 
-    # Chuyển đổi current_date thành offset-naive để tránh lỗi
-    current_date_naive = current_date.replace(tzinfo=None)
+    async def handle():
+        # Kiểm tra username, cửa hàng và đăng ký ca trước khi tạo hoặc xếp job
+        week_number, year = get_current_week()
+        validate_assignments(db, shifts_dict, current_user.username, week_number, year)
+
+        # Chạy trong job nền, trả về job_id ngay lập tức
+        if background:
+            job_id = enqueue_job(
+                db, "approve_assign_table",
+                {"shifts": shifts_dict, "manager": manager},
+                current_user.username
+            )
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={"status": "queued", "job_id": job_id}
+            )
 
-    # Tính số tuần kể từ đầu năm
-    week_number = ((current_date_naive - year_start).days // 7) + 1
+        try:
+            # Chèn assign table vào MongoDB
+            table_id = create_assign_table(db, shifts_dict, manager)
+            return {"status": "success", "table_id": table_id}
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=500, detail=f"Error inserting document: {str(e)}"
+            )
 
-    # Danh sách username từ shifts
-    employee_usernames = []
-    shifts_with_status = []
+    # Client gửi lại cùng Idempotency-Key sẽ nhận lại kết quả cũ, không tạo thêm assign table
+    return await run_idempotent(
+        db, idempotency_key, "approve_assign_table", current_user.username,
+        {"shifts": shifts_dict, "background": background}, handle
+    )
 
-    for shift in shifts:
-        # Thêm trường status vào shift
-        shift_dict = shift.model_dump()
-        shift_dict["status"] = "undone"
-        shifts_with_status.append(shift_dict)
 
-        if shift.username not in employee_usernames:
-            employee_usernames.append(shift.username)
+@router.post("/copy_assign_table/{week_number}/")
+async def copy_assign_table_forward(
+    week_number: int,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    offset: int = Query(1, ge=1, le=MAX_WEEK_RANGE),
+    drop_inactive: bool = False,
+    db=Depends(get_database)
+):
+    target_week = week_number + offset
+    # Không tự chuyển sang năm sau, manager tạo assign table của năm mới như bình thường
+    if target_week > MAX_WEEK_NUMBER:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Target week {target_week} is past the end of the year (week {MAX_WEEK_NUMBER})."
+        )
 
-    # Xây dựng dữ liệu cho assign table
-    assign_table = {
-        "table_id": table_id,
+    # Chỉ sao chép assign table của cửa hàng mình trong năm hiện tại
+    year = get_current_week()[1]
+    store_filter = {
         "table_type": "assign",
-        "week": week_number,
-        "date": current_date,
-        "user_details": {
-            "user_id": current_user.user_id,
-            "username": current_user.username
-        },
-        "shifts": shifts_with_status,
-        "employee_usernames": employee_usernames
+        "user_details.username": current_user.username,
+        "year": year
     }
 
-    try:
-        # Chèn assign table vào MongoDB
-        db["tables"].insert_one(assign_table)
-        return {"status": "success", "table_id": table_id}
-    except Exception as e:
+    if not db["tables"].find_one({**store_filter, "week": week_number}, projection={"_id": 1}):
         raise HTTPException(
-            status_code=500, detail=f"Error inserting document: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Assign table not found for the given week."
+        )
+    # Kiểm tra sớm để khỏi tốn table_id; unique index mới là chốt chặn khi copy đồng thời
+    if db["tables"].find_one({**store_filter, "week": target_week}, projection={"_id": 1}):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Assign table for week {target_week} already exists."
         )
 
+    manager = {
+        "user_id": current_user.user_id,
+        "username": current_user.username
+    }
+
+    # Sao chép hoàn toàn trong MongoDB, ca không phải đi qua server ứng dụng
+    table_id = copy_assign_table(
+        db, week_number, offset, year, manager, drop_inactive)
+
+    return JSONResponse(
+        status_code=status.HTTP_201_CREATED,
+        content={
+            "msg": "Assign table copied successfully",
+            "table_id": table_id,
+            "week": target_week
+        }
+    )
+
 
 @router.get("/assign_table_me/{week_number}/")
 async def get_personal_assign_table_for_week(
@@ -185,12 +308,7 @@ async def get_personal_assign_table_for_week(
     db=Depends(get_database)
 ):
     # Fetch the assign table for the given week
-    assign_table = db["tables"].find_one(
-        {
-            "table_type": "assign",
-            "week": week_number
-        }
-    )
+    assign_table = get_assign_table(db, week_number)
 
     if not assign_table:
         raise HTTPException(
@@ -219,15 +337,25 @@ async def get_personal_assign_table_for_week(
 async def get_general_assign_table_for_week(
     week_number: int,
     current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    fields: str | None = None,
+    expand: str | None = Query(None, pattern="^users$"),
+    user_loader: UserLoader = Depends(get_user_loader),
     db=Depends(get_database)
 ):
+    projection = build_fields_projection(fields)
+
     # Fetch the assign table for the given week
-    assign_table = db["tables"].find_one(
-        {
-            "table_type": "assign",
-            "week": week_number
-        }
-    )
+    # Bản đầy đủ đọc qua cache, chỉ truy vấn trực tiếp khi client chọn fields
+    if projection:
+        assign_table = db["tables"].find_one(
+            {
+                "table_type": "assign",
+                "week": week_number
+            },
+            projection=projection
+        )
+    else:
+        assign_table = get_assign_table(db, week_number)
 
     if not assign_table:
         raise HTTPException(
@@ -235,15 +363,195 @@ async def get_general_assign_table_for_week(
             detail="Assign table not found for the given week."
         )
 
-    # Return the complete assign table data
+    # Chỉ trả về các field client yêu cầu
+    if projection:
+        response = assign_table
+    else:
+        # Return the complete assign table data
+        response = {
+            "table_id": assign_table.get("table_id"),
+            "table_type": assign_table.get("table_type"),
+            "week": assign_table.get("week"),
+            "date": assign_table.get("date"),
+            "user_details": assign_table.get("user_details"),
+            "shifts": assign_table.get("shifts"),
+            "employee_usernames": assign_table.get("employee_usernames")
+        }
+
+    # Lấy thông tin mọi username được tham chiếu bằng một truy vấn gộp
+    if expand == "users":
+        response["users"] = user_loader.load_many(
+            collect_usernames([assign_table]))
+    return response
+
+
+@router.get("/assign_table_me_range/")
+async def get_personal_assign_tables_for_week_range(
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["employee"])],
+    from_week: int = Query(..., alias="from", ge=1),
+    to_week: int = Query(..., alias="to", ge=1),
+    year: int | None = Query(None, ge=1),
+    shift_name: str | None = None,
+    db=Depends(get_database)
+):
+    validate_week_range(from_week, to_week)
+    # Mặc định là năm hiện tại
+    year = year or get_current_week()[1]
+
+    # Chỉ giữ lại các ca của user hiện tại ngay trong aggregation
+    assign_tables = db["tables"].aggregate(build_week_range_pipeline(
+        "assign", from_week, to_week, year, username=current_user.username, shift_name=shift_name))
+
+    weeks = {week: None for week in range(from_week, to_week + 1)}
+    for assign_table in assign_tables:
+        # Giống find_one: mỗi tuần lấy assign table đầu tiên
+        if weeks[assign_table["week"]] is None:
+            weeks[assign_table["week"]] = {
+                "table_id": assign_table.get("table_id"),
+                "table_type": assign_table.get("table_type"),
+                "week": assign_table.get("week"),
+                "date": assign_table.get("date"),
+                "user_details": assign_table.get("user_details"),
+                "shifts": assign_table.get("shifts", [])
+            }
+
     return {
-        "table_id": assign_table.get("table_id"),
-        "table_type": assign_table.get("table_type"),
-        "week": assign_table.get("week"),
-        "date": assign_table.get("date"),
-        "user_details": assign_table.get("user_details"),
-        "shifts": assign_table.get("shifts"),
-        "employee_usernames": assign_table.get("employee_usernames")
+        "from": from_week,
+        "to": to_week,
+        "year": year,
+        "weeks": [{"week": week, "assign_table": table} for week, table in weeks.items()]
+    }
+
+
+@router.get("/assign_table_range/")
+async def get_general_assign_tables_for_week_range(
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    from_week: int = Query(..., alias="from", ge=1),
+    to_week: int = Query(..., alias="to", ge=1),
+    year: int | None = Query(None, ge=1),
+    shift_name: str | None = None,
+    fields: str | None = None,
+    expand: str | None = Query(None, pattern="^users$"),
+    user_loader: UserLoader = Depends(get_user_loader),
+    db=Depends(get_database)
+):
+    validate_week_range(from_week, to_week)
+    projection = build_fields_projection(fields, required={"week"})
+    # Mặc định là năm hiện tại
+    year = year or get_current_week()[1]
+
+    assign_tables = db["tables"].aggregate(build_week_range_pipeline(
+        "assign", from_week, to_week, year, shift_name=shift_name, projection=projection))
+
+    weeks = {week: None for week in range(from_week, to_week + 1)}
+    for assign_table in assign_tables:
+        # Giống find_one: mỗi tuần lấy assign table đầu tiên
+        if weeks[assign_table["week"]] is not None:
+            continue
+        if projection:
+            weeks[assign_table["week"]] = assign_table
+        else:
+            weeks[assign_table["week"]] = {
+                "table_id": assign_table.get("table_id"),
+                "table_type": assign_table.get("table_type"),
+                "week": assign_table.get("week"),
+                "date": assign_table.get("date"),
+                "user_details": assign_table.get("user_details"),
+                "shifts": assign_table.get("shifts"),
+                "employee_usernames": assign_table.get("employee_usernames")
+            }
+
+    response = {
+        "from": from_week,
+        "to": to_week,
+        "year": year,
+        "weeks": [{"week": week, "assign_table": table} for week, table in weeks.items()]
+    }
+    if expand == "users":
+        response["users"] = user_loader.load_many(
+            collect_usernames(weeks.values()))
+    return response
+
+
+@router.get("/coverage/{week_number}/")
+async def get_staffing_coverage(
+    week_number: int,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    min_staff: int = Query(1, ge=0),
+    year: int | None = Query(None, ge=1),
+    db=Depends(get_database)
+):
+    # Số tuần lặp lại mỗi năm, mặc định là năm hiện tại
+    year = year or get_current_week()[1]
+
+    # Chỉ đọc bitmap, không tải danh sách ca của từng register table
+    register_tables = db["tables"].find(
+        {"table_type": "register", "week": week_number, "year": year},
+        projection={"_id": 0, "availability_bitmap": 1}
+    )
+    available = count_slots(
+        table.get("availability_bitmap", 0) for table in register_tables)
+
+    assign_table = db["tables"].find_one(
+        {"table_type": "assign", "week": week_number, "year": year},
+        projection={"_id": 0, "bitmaps": 1}
+    )
+    assigned = count_slots(
+        employee["bitmap"] for employee in (assign_table or {}).get("bitmaps", []))
+
+    slots = []
+    for slot, (available_count, assigned_count) in enumerate(zip(available, assigned)):
+        slots.append({
+            **describe_slot(slot),
+            "available": available_count,
+            "assigned": assigned_count,
+            "understaffed": assigned_count < min_staff
+        })
+
+    return {
+        "week": week_number,
+        "year": year,
+        "min_staff": min_staff,
+        "slots": slots,
+        "understaffed_slots": [slot for slot in slots if slot["understaffed"]]
+    }
+
+
+@router.get("/available/{week_number}/")
+async def get_available_employees(
+    week_number: int,
+    current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    day: int = Query(..., ge=0, le=6, description="0 = Monday, 6 = Sunday"),
+    shift_name: str = Query(...),
+    year: int | None = Query(None, ge=1),
+    db=Depends(get_database)
+):
+    slot = get_slot(day, shift_name)
+    if slot is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown shift_name. Must be one of: {', '.join(SHIFT_NAMES)}."
+        )
+
+    # Số tuần lặp lại mỗi năm, mặc định là năm hiện tại
+    year = year or get_current_week()[1]
+
+    # MongoDB kiểm tra bit trực tiếp trên server
+    register_tables = db["tables"].find(
+        {
+            "table_type": "register",
+            "week": week_number,
+            "year": year,
+            "availability_bitmap": {"$bitsAllSet": 1 << slot}
+        },
+        projection={"_id": 0, "user_details.username": 1}
+    )
+
+    return {
+        "week": week_number,
+        "year": year,
+        **describe_slot(slot),
+        "usernames": [table["user_details"]["username"] for table in register_tables]
     }
 
 
@@ -278,7 +586,14 @@ async def modify_assign(
 
     assign_table_model = AssignTable(**assign_table)
 
+    # Năm của tuần cần sửa lấy theo ngày tạo assign table
+    assign_year = assign_table["date"].year
+
     if modify_type == "add":
+        validate_assignments(
+            db, [shift.model_dump() for shift in shift_data],
+            current_user.username, week, assign_year)
+
         for shift in shift_data:
             # Check if the shift already exists in the assign table
             if any(s.shift_name == shift.shift_name and s.date == shift.date and s.username == shift.username for s in assign_table_model.shifts):
@@ -287,7 +602,7 @@ async def modify_assign(
             # Set status to "undone" for new shifts
             shift_dict = shift.model_dump()
             shift_dict['status'] = "undone"
-            assign_table_model.shifts.append(shift_dict)
+            assign_table_model.shifts.append(ShiftForAssign(**shift_dict))
 
             # Add username to the list if it's not already present
             if shift.username not in assign_table_model.employee_usernames:
@@ -344,6 +659,10 @@ async def modify_assign(
             )
 
         shift_to_pass = shift_data[0]
+        # Người nhận ca phải thỏa cùng điều kiện như khi thêm ca
+        validate_assignments(
+            db, [{**shift_to_pass.model_dump(), "username": new_username}],
+            current_user.username, week, assign_year)
 
         # Update shift
         for shift in assign_table_model.shifts:
@@ -358,11 +677,17 @@ async def modify_assign(
             ModifyHistory(modify_type="pass", description=modify_description)
         )
 
+    # Cập nhật lại bitmap theo danh sách ca mới
+    assign_table_model.bitmaps = [
+        EmployeeBitmap(**bitmap) for bitmap in build_assign_bitmaps([s.model_dump() for s in assign_table_model.shifts])
+    ]
+
     # Update the database
     db["tables"].update_one(
         {"table_id": assign_table_model.table_id},
         {"$set": assign_table_model.model_dump()}
     )
+    assign_table_cache.delete(week)
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
@@ -375,49 +700,42 @@ async def approve_worked_shifts(
     # List of shifts employee completed
     shifts_to_approve: list[ShiftForEmployee],
     current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
+    background: bool = False,
+    idempotency_key: Annotated[str | None, Header(max_length=255)] = None,
     db=Depends(get_database)
 ):
     current_date = datetime.now(timezone.utc)
     # Chuyển đổi current_date thành offset-naive để tránh lỗi
     current_date_naive = current_date.replace(tzinfo=None)
 
+    # Validate shift date
     for shift in shifts_to_approve:
-        # Validate shift date
         if shift.date > current_date_naive:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Cannot approve future shifts for date: {shift.date}"
             )
 
-        # Update assign table: find the shift and mark it as 'done'
-        result = db["tables"].update_one(
-            {
-                "table_type": "assign",
-                "shifts.shift_name": shift.shift_name,
-                "shifts.date": shift.date
-            },
-            {
-                "$set": {"shifts.$.status": "done"}
-            }
-        )
+    shifts_dict = [shift.model_dump() for shift in shifts_to_approve]
 
-        if result.modified_count == 0:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Shift not found for {shift.shift_name} on {shift.date}"
+    async def handle():
+        # Chạy trong job nền, trả về job_id ngay lập tức
+        if background:
+            job_id = enqueue_job(
+                db, "approve_worked_shifts", {"shifts": shifts_dict}, current_user.username
+            )
+            return JSONResponse(
+                status_code=status.HTTP_202_ACCEPTED,
+                content={"status": "queued", "job_id": job_id}
             )
 
-        # Add shift to employee's worked_shifts
-        db["users"].update_one(
-            {"username": shift.username},
-            {
-                "$push": {
-                    "worked_shifts": {
-                        "shift_name": shift.shift_name,
-                        "date": shift.date,
-                    }
-                }
-            }
-        )
+        for shift in shifts_dict:
+            approve_worked_shift(db, shift)
 
-    return {"status": "success", "message": "Shifts approved and recorded as 'done'."}
+        return {"status": "success", "message": "Shifts approved and recorded as 'done'."}
+
+    # Client gửi lại cùng Idempotency-Key sẽ không ghi thêm worked_shifts
+    return await run_idempotent(
+        db, idempotency_key, "approve_worked_shifts", current_user.username,
+        {"shifts": shifts_dict, "background": background}, handle
+    )
@@ -1,9 +1,12 @@
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, Security
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 from app.dependencies import get_database
 from app.models.user_model import ClientUser, Employee
 from app.services.auth_service import get_current_user
+from app.services.cache_service import user_cache, user_id_cache
 
 router = APIRouter()
 
@@ -34,13 +37,22 @@ async def update_information(
         raise HTTPException(
             status_code=400, detail="No valid fields to update")
 
-    # Cập nhật thông tin cho user hiện tại (dựa trên username)
-    db["users"].update_one({"user_id": current_user.user_id}, {
-                           "$set": filtered_update_data})
+    # Cập nhật và lấy lại user trong cùng một round trip
+    try:
+        updated_user = db["users"].find_one_and_update(
+            {"user_id": current_user.user_id},
+            {"$set": filtered_update_data},
+            projection={"_id": 0, "password": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Email already in use")
+
+    if not updated_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user_cache.delete(current_user.username)
 
     # Trả về user đã được cập nhật
-    updated_user = db["users"].find_one(
-        {"user_id": current_user.user_id}, {"_id": 0, "password": 0})
     return {"msg": "Your information has been updated successfully", "user": updated_user}
 
 
@@ -72,16 +84,29 @@ async def update_user(
     current_user: Annotated[ClientUser, Security(get_current_user, scopes=["manager"])],
     db=Depends(get_database)
 ):
-    # Tìm user dựa vào user_id
-    user = db["users"].find_one({"user_id": user_id})
+    if not update_data:
+        raise HTTPException(
+            status_code=400, detail="No fields to update")
+
+    # Cập nhật và lấy lại user trong cùng một round trip
+    try:
+        updated_user = db["users"].find_one_and_update(
+            {"user_id": user_id},
+            {"$set": update_data},
+            projection={"_id": 0, "password": 0},
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=409, detail="Username or email already in use")
 
-    if not user:
+    if not updated_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Cập nhật chỉ các trường được gửi trong update_data
-    db["users"].update_one({"user_id": user_id}, {"$set": update_data})
+    # Bỏ cache theo user_id nên bản cache dưới username cũ cũng hết hiệu lực khi đổi username
+    user_id_cache.delete(user_id)
+    user_id_cache.delete(updated_user["user_id"])
+    user_cache.delete(updated_user["username"])
 
     # Trả về user đã cập nhật
-    updated_user = db["users"].find_one(
-        {"user_id": user_id}, {"_id": 0, "password": 0})
     return {"msg": "User updated successfully", "user": updated_user}
@@ -12,6 +12,7 @@ from dotenv import load_dotenv
 from app.dependencies import get_database
 from app.models.auth_model import TokenData
 from app.models.user_model import ClientUser
+from app.services.cache_service import user_cache, user_id_cache
 
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -43,6 +44,23 @@ def create_access_token(data: dict, scopes: list, expires_delta: timedelta | Non
     return encoded_jwt
 
 
+def decode_access_token(token: str) -> dict | None:
+    # Chỉ kiểm tra chữ ký và hạn của token, không truy vấn database
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+
+
+def get_bearer_token(authorization: str | None) -> str | None:
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return token
+
+
 # Hàm hash và verify password
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -64,23 +82,29 @@ def get_current_user(security_scopes: SecurityScopes, token: Annotated[str, Depe
     else:
         authenticate_value = f'Bearer'
 
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_scopes: list = payload.get("scopes", [])
-        token_data = TokenData(username=username, scopes=token_scopes)
-    except jwt.InvalidTokenError:
+    payload = decode_access_token(token)
+    if payload is None:
         raise credentials_exception
-
-    user_dict = db["users"].find_one(
-        {"username": username},
-        projection={"_id": 0, "password": 0}
-    )
-
-    if user_dict is None:
+    username: str = payload.get("sub")
+    if username is None:
         raise credentials_exception
+    token_scopes: list = payload.get("scopes", [])
+    token_data = TokenData(username=username, scopes=token_scopes)
+
+    # Mỗi request đã xác thực đều cần user, nên đọc qua cache trước.
+    # Bản cache chỉ dùng được khi user_id vẫn trỏ về đúng username này
+    user_dict = user_cache.get(username)
+    if user_dict is not None and user_id_cache.get(user_dict["user_id"]) != {"username": username}:
+        user_dict = None
+    if user_dict is None:
+        user_dict = db["users"].find_one(
+            {"username": username},
+            projection={"_id": 0, "password": 0}
+        )
+        if user_dict is None:
+            raise credentials_exception
+        user_cache.set(username, user_dict)
+        user_id_cache.set(user_dict["user_id"], {"username": username})
 
     user = ClientUser(**user_dict)
 
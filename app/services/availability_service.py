@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+# Thứ tự các ca trong ngày, mỗi ca ứng với một bit trong bitmap của từng ngày
+SHIFT_NAMES = [name.strip().lower() for name in os.getenv(
+    "SHIFT_NAMES", "morning,afternoon,evening").split(",") if name.strip()]
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday",
+             "Thursday", "Friday", "Saturday", "Sunday"]
+SLOT_COUNT = len(DAY_NAMES) * len(SHIFT_NAMES)
+
+# Bitmap được lưu dưới dạng int64 của MongoDB
+if SLOT_COUNT > 63:
+    raise ValueError("Too many SHIFT_NAMES: a week bitmap must fit in 63 bits.")
+
+
+def get_slot(day: int, shift_name: str) -> int | None:
+    try:
+        return day * len(SHIFT_NAMES) + SHIFT_NAMES.index(shift_name.lower())
+    except ValueError:
+        return None
+
+
+def get_shift_slot(shift_name: str, date: datetime) -> int | None:
+    # MongoDB lưu datetime theo UTC nên ngày trong tuần cũng tính theo UTC
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc)
+    return get_slot(date.weekday(), shift_name)
+
+
+def shifts_to_bitmap(shifts: list[dict]) -> int:
+    bitmap = 0
+    for shift in shifts:
+        slot = get_shift_slot(shift["shift_name"], shift["date"])
+        # Ca không nằm trong SHIFT_NAMES sẽ không được đưa vào bitmap
+        if slot is not None:
+            bitmap |= 1 << slot
+    return bitmap
+
+
+def build_assign_bitmaps(shifts: list[dict]) -> list[dict]:
+    bitmaps = {}
+    for shift in shifts:
+        bitmaps.setdefault(shift["username"], [])
+        bitmaps[shift["username"]].append(shift)
+    return [
+        {"username": username, "bitmap": shifts_to_bitmap(user_shifts)}
+        for username, user_shifts in bitmaps.items()
+    ]
+
+
+def count_slots(bitmaps) -> list[int]:
+    # Chỉ duyệt các bit đang bật của từng bitmap
+    counts = [0] * SLOT_COUNT
+    for bitmap in bitmaps:
+        while bitmap:
+            lowest_bit = bitmap & -bitmap
+            counts[lowest_bit.bit_length() - 1] += 1
+            bitmap ^= lowest_bit
+    return counts
+
+
+def describe_slot(slot: int) -> dict:
+    day, shift_index = divmod(slot, len(SHIFT_NAMES))
+    return {"day": DAY_NAMES[day], "shift_name": SHIFT_NAMES[shift_index]}
+
+
+def backfill_bitmaps(db):
+    # Bổ sung bitmap cho các table được tạo trước khi có bitmap
+    for table in db["tables"].find(
+        {"table_type": "register", "availability_bitmap": {"$exists": False}},
+        projection={"shifts.shift_name": 1, "shifts.date": 1}
+    ):
+        db["tables"].update_one(
+            {"_id": table["_id"]},
+            {"$set": {"availability_bitmap": shifts_to_bitmap(table.get("shifts", []))}}
+        )
+
+    for table in db["tables"].find(
+        {"table_type": "assign", "bitmaps": {"$exists": False}},
+        projection={"shifts.shift_name": 1,
+                    "shifts.date": 1, "shifts.username": 1}
+    ):
+        db["tables"].update_one(
+            {"_id": table["_id"]},
+            {"$set": {"bitmaps": build_assign_bitmaps(table.get("shifts", []))}}
+        )
@@ -0,0 +1,182 @@
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+import bson
+
+try:
+    import redis
+except ImportError:  # redis là tùy chọn, chỉ cần khi CACHE_BACKEND=redis
+    redis = None
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_URL = os.getenv("CACHE_URL", "redis://localhost:6379/0")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", 60))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+# Near-cache trong từng worker chỉ giữ ngắn hạn, phòng khi mất message invalidation
+CACHE_NEAR_TTL_SECONDS = int(os.getenv("CACHE_NEAR_TTL_SECONDS", 5))
+CACHE_INVALIDATION_CHANNEL = os.getenv(
+    "CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+
+class CacheBackend(ABC):
+    # Giá trị là dict dạng document MongoDB (có thể chứa datetime)
+    @abstractmethod
+    def get(self, key: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: dict, ttl: int):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        ...
+
+
+class MemoryCacheBackend(CacheBackend):
+    # LRU có TTL trong một process, mỗi worker giữ bản riêng
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # Lưu dạng BSON để người gọi không sửa được giá trị đang nằm trong cache
+        return bson.decode(data)
+
+    def set(self, key: str, value: dict, ttl: int):
+        data = bson.encode(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, data)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RedisCacheBackend(CacheBackend):
+    # Cache dùng chung giữa các worker, kèm near-cache trong process.
+    # Khi xóa một key, worker phát key đó qua pub/sub để các worker khác bỏ near-cache.
+    def __init__(self, client, near_ttl: int = CACHE_NEAR_TTL_SECONDS, channel: str = CACHE_INVALIDATION_CHANNEL):
+        self.client = client
+        self.near_ttl = near_ttl
+        self.channel = channel
+        self.near_cache = MemoryCacheBackend()
+        self.worker_id = uuid.uuid4().hex
+
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{channel: self._on_invalidate})
+        self._listener = pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
+    def get(self, key: str) -> dict | None:
+        value = self.near_cache.get(key)
+        if value is not None:
+            return value
+
+        data = self.client.get(key)
+        if data is None:
+            return None
+        value = bson.decode(data)
+        self.near_cache.set(key, value, self.near_ttl)
+        return value
+
+    def set(self, key: str, value: dict, ttl: int):
+        self.client.set(key, bson.encode(value), ex=ttl)
+        self.near_cache.set(key, value, min(self.near_ttl, ttl))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+        self.near_cache.delete(key)
+        self.client.publish(self.channel, f"{self.worker_id}|{key}")
+
+    def close(self):
+        self._listener.stop()
+
+    def _on_invalidate(self, message):
+        data = message["data"]
+        if isinstance(data, bytes):
+            data = data.decode()
+        worker_id, _, key = data.partition("|")
+        if worker_id != self.worker_id:
+            self.near_cache.delete(key)
+
+
+class Cache:
+    # Gom key theo namespace ("users", "assign_tables", ...) trên backend dùng chung.
+    # Backend được lấy khi dùng nên có thể tạo Cache ở cấp module.
+    def __init__(self, namespace: str, ttl: int = CACHE_TTL_SECONDS):
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key) -> dict | None:
+        return get_cache_backend().get(self._key(key))
+
+    def set(self, key, value: dict):
+        get_cache_backend().set(self._key(key), value, self.ttl)
+
+    def delete(self, key):
+        get_cache_backend().delete(self._key(key))
+
+    def _key(self, key) -> str:
+        return f"{self.namespace}:{key}"
+
+
+_backend: CacheBackend | None = None
+_backend_lock = threading.Lock()
+
+
+def create_cache_backend() -> CacheBackend:
+    if CACHE_BACKEND == "memory":
+        return MemoryCacheBackend()
+    if CACHE_BACKEND == "redis":
+        if redis is None:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package.")
+        return RedisCacheBackend(redis.Redis.from_url(CACHE_URL))
+    raise ValueError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND}")
+
+
+def get_cache_backend() -> CacheBackend:
+    # Tạo backend khi dùng lần đầu để mỗi process (kể cả process chạy job) có kết nối riêng
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_cache_backend()
+        return _backend
+
+
+def set_cache_backend(backend: CacheBackend | None):
+    # Cho phép thay backend, ví dụ RedisCacheBackend(fakeredis.FakeRedis()) khi test
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def get_cache(namespace: str, ttl: int = CACHE_TTL_SECONDS) -> Cache:
+    return Cache(namespace, ttl)
+
+
+# User theo username (get_current_user) và assign table theo tuần
+user_cache = get_cache("users")
+assign_table_cache = get_cache("assign_tables")
+# Username hiện tại theo user_id: bỏ key này là mọi bản cache của user đó không còn hợp lệ,
+# kể cả bản nằm dưới username cũ sau khi đổi tên
+user_id_cache = get_cache("user_ids")
@@ -0,0 +1,143 @@
+import csv
+import io
+import re
+from datetime import datetime, timezone
+
+CSV_COLUMNS = ["table_id", "week", "shift_name", "date",
+               "duration", "username", "status"]
+
+
+def build_shift_export_pipeline(start: datetime, end: datetime, table_filter: dict | None = None, username: str | None = None) -> list:
+    # Lọc trước theo các field có thể dùng index, sau đó mới unwind từng ca
+    shift_filter = {"shifts.date": {"$gte": start, "$lt": end}}
+    if username:
+        shift_filter["shifts.username"] = username
+
+    table_filter = {"table_type": "assign", **(table_filter or {})}
+    table_filter["shifts"] = {"$elemMatch": {
+        k.removeprefix("shifts."): v for k, v in shift_filter.items()}}
+
+    return [
+        {"$match": table_filter},
+        {"$unwind": "$shifts"},
+        {"$match": shift_filter},
+        {"$sort": {"shifts.date": 1, "shifts.shift_name": 1}},
+        {
+            "$project": {
+                "_id": 0,
+                "table_id": 1,
+                "week": 1,
+                "shift_name": "$shifts.shift_name",
+                "date": "$shifts.date",
+                "duration": "$shifts.duration",
+                "username": "$shifts.username",
+                "status": "$shifts.status",
+            }
+        }
+    ]
+
+
+def stream_shifts_csv(cursor):
+    # Ghi từng dòng vào một buffer nhỏ rồi xả ngay, bộ nhớ không tăng theo số ca
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(CSV_COLUMNS)
+    yield buffer.getvalue()
+
+    for row in cursor:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow([_csv_value(row.get(column))
+                        for column in CSV_COLUMNS])
+        yield buffer.getvalue()
+
+
+def stream_shifts_ics(cursor, calendar_name: str):
+    yield _ics_lines([
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Shift Management System//Shift Export//EN",
+        "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{_ics_escape(calendar_name)}",
+    ])
+
+    stamp = _ics_datetime(datetime.now(timezone.utc))
+    for row in cursor:
+        date = row.get("date")
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:{row.get('table_id')}-{row.get('username')}-{_ics_datetime(date)}-{row.get('shift_name')}@shift-management",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{_ics_datetime(date)}",
+        ]
+        duration = _ics_duration(row.get("duration"))
+        if duration:
+            lines.append(f"DURATION:{duration}")
+        lines.extend([
+            f"SUMMARY:{_ics_escape(row.get('shift_name'))} - {_ics_escape(row.get('username'))}",
+            f"DESCRIPTION:{_ics_escape(_ics_description(row))}",
+            "END:VEVENT",
+        ])
+        yield _ics_lines(lines)
+
+    yield _ics_lines(["END:VCALENDAR"])
+
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+ICS_MAX_LINE_OCTETS = 75
+
+
+def _ics_lines(lines: list[str]) -> str:
+    return "".join(f"{_ics_fold(line)}\r\n" for line in lines)
+
+
+def _ics_fold(line: str) -> str:
+    # RFC 5545 3.1: mỗi dòng tối đa 75 octet, dòng tiếp theo bắt đầu bằng một dấu cách.
+    # Đếm theo byte UTF-8 và không cắt giữa một ký tự nhiều byte
+    parts = []
+    current = ""
+    current_octets = 0
+    limit = ICS_MAX_LINE_OCTETS
+    for char in line:
+        char_octets = len(char.encode("utf-8"))
+        if current_octets + char_octets > limit:
+            parts.append(current)
+            current = " "
+            current_octets = 1
+        current += char
+        current_octets += char_octets
+    parts.append(current)
+    return "\r\n".join(parts)
+
+
+def _ics_datetime(value: datetime) -> str:
+    # MongoDB trả về datetime không có múi giờ nhưng thực chất là UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def _ics_duration(duration) -> str | None:
+    # Chỉ hỗ trợ dạng số giờ, ví dụ "4", "4h", "4.5 hours"
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*(h|hr|hrs|hour|hours)?\s*$",
+                     str(duration or ""), re.IGNORECASE)
+    if not match:
+        return None
+    minutes = round(float(match.group(1)) * 60)
+    return f"PT{minutes // 60}H{minutes % 60}M"
+
+
+def _ics_description(row: dict) -> str:
+    return f"Duration: {row.get('duration')} - Status: {row.get('status')} - Table: {row.get('table_id')}"
+
+
+def _ics_escape(value) -> str:
+    text = "" if value is None else str(value)
+    return (text.replace("\\", "\\\\").replace(";", "\\;")
+            .replace(",", "\\,").replace("\n", "\\n"))
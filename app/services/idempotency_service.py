@@ -0,0 +1,149 @@
+import hashlib
+import json
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response
+from pymongo.errors import DuplicateKeyError
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+IDEMPOTENCY_KEY_TTL_SECONDS = int(
+    os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", 24 * 60 * 60))
+# Thời gian giữ key khi đang xử lý; worker chết giữa chừng thì request sau được tiếp quản.
+# Lease được gia hạn liên tục khi handler còn chạy nên request chậm không bị chiếm key
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", 120))
+
+
+class LeaseRenewer(threading.Thread):
+    # Chạy trong thread riêng vì handler gọi pymongo đồng bộ và có thể chặn event loop
+    def __init__(self, collection, lease_filter: dict):
+        super().__init__(name="idempotency-lease", daemon=True)
+        self.collection = collection
+        self.lease_filter = lease_filter
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(IDEMPOTENCY_LEASE_SECONDS / 3):
+            renewed = self.collection.update_one(
+                {**self.lease_filter, "status": "in_progress"},
+                {"$set": {"locked_until": _lease_deadline()}}
+            )
+            # Lease đã mất (key bị xóa hoặc đã xong) thì dừng gia hạn
+            if renewed.matched_count == 0:
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+def request_fingerprint(payload) -> str:
+    # Cùng một key phải đi kèm cùng một nội dung request
+    encoded = json.dumps(jsonable_encoder(payload),
+                         sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+async def run_idempotent(db, idempotency_key: str | None, scope: str, owner_username: str, payload, handler) -> Response:
+    # Không có Idempotency-Key thì xử lý như bình thường
+    if not idempotency_key:
+        return _to_response(await handler())
+
+    record_filter = {
+        "key": idempotency_key,
+        "scope": scope,
+        "owner_username": owner_username
+    }
+    fingerprint = request_fingerprint(payload)
+
+    # Chiếm key trước khi xử lý, request trùng sẽ nhận DuplicateKeyError
+    lease_id = uuid.uuid4().hex
+    try:
+        db["idempotency_keys"].insert_one({
+            **record_filter,
+            "fingerprint": fingerprint,
+            "status": "in_progress",
+            "lease_id": lease_id,
+            "locked_until": _lease_deadline(),
+            "created_at": datetime.now(timezone.utc)
+        })
+    except DuplicateKeyError:
+        replay = _replay_or_take_over(db, record_filter, fingerprint, lease_id)
+        if replay is not None:
+            return replay
+
+    # Chỉ request còn giữ lease mới được ghi kết quả hoặc trả key
+    lease_filter = {**record_filter, "lease_id": lease_id}
+    renewer = LeaseRenewer(db["idempotency_keys"], lease_filter)
+    renewer.start()
+    try:
+        response = _to_response(await handler())
+    except Exception:
+        # Request lỗi thì bỏ key để client có thể gửi lại
+        db["idempotency_keys"].delete_one(lease_filter)
+        raise
+    finally:
+        renewer.stop()
+
+    # Chỉ lưu kết quả thành công, lỗi 5xx cho phép gửi lại
+    if response.status_code >= 500:
+        db["idempotency_keys"].delete_one(lease_filter)
+        return response
+
+    db["idempotency_keys"].update_one(
+        lease_filter,
+        {"$set": {
+            "status": "completed",
+            "status_code": response.status_code,
+            "body": response.body.decode(),
+            "media_type": response.media_type
+        }, "$unset": {"locked_until": ""}}
+    )
+    return response
+
+
+def _lease_deadline() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+
+
+def _replay_or_take_over(db, record_filter: dict, fingerprint: str, lease_id: str) -> Response | None:
+    # Trả về response đã lưu, hoặc None nếu request này đã tiếp quản được key
+    record = db["idempotency_keys"].find_one(record_filter)
+
+    if record and record["fingerprint"] != fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="This Idempotency-Key was already used with a different request."
+        )
+    if record and record["status"] == "completed":
+        return Response(
+            content=record["body"],
+            status_code=record["status_code"],
+            media_type=record["media_type"],
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    # Lease đã hết hạn nghĩa là worker xử lý trước đó đã chết, chiếm lại key một cách nguyên tử
+    taken_over = db["idempotency_keys"].find_one_and_update(
+        {**record_filter, "status": "in_progress",
+         "locked_until": {"$lt": datetime.now(timezone.utc)}},
+        {"$set": {"lease_id": lease_id, "locked_until": _lease_deadline()}}
+    )
+    if taken_over is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A request with this Idempotency-Key is still in progress."
+        )
+    return None
+
+
+def _to_response(result) -> Response:
+    if isinstance(result, Response):
+        return result
+    return JSONResponse(content=jsonable_encoder(result))
@@ -0,0 +1,266 @@
+import asyncio
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+
+from fastapi import HTTPException
+from pymongo import ReturnDocument
+
+from app.dependencies import get_database
+from app.services.table_service import approve_worked_shift, create_assign_table
+from app.services.user_service import create_user_account
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", 2))
+# Job "running" không cập nhật quá thời gian này được xem là worker đã chết
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", 600))
+JOB_PROGRESS_INTERVAL_SECONDS = 1.0
+
+# Dữ liệu nhạy cảm (mật khẩu) chỉ được truyền trong bộ nhớ cho worker, không lưu vào collection jobs
+_job_secrets: dict[str, dict] = {}
+_executor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Dùng "spawn" để mỗi worker tự tạo MongoClient riêng (MongoClient không an toàn khi fork)
+        _executor = ProcessPoolExecutor(
+            max_workers=JOB_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def enqueue_job(db, job_type: str, payload: dict, owner_username: str, secrets: dict | None = None) -> str:
+    if job_type not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job type: {job_type}")
+
+    now = datetime.now(timezone.utc)
+    job_id = uuid.uuid4().hex
+    db["jobs"].insert_one({
+        "job_id": job_id,
+        "job_type": job_type,
+        "status": "queued",
+        "owner_username": owner_username,
+        "payload": payload,
+        "progress": {"done": 0, "total": 0},
+        "attempts": 0,
+        "max_attempts": JOB_MAX_ATTEMPTS,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now
+    })
+
+    if secrets:
+        _job_secrets[job_id] = secrets
+    submit_job(job_id)
+    return job_id
+
+
+def submit_job(job_id: str):
+    executor = get_executor()
+    future = executor.submit(run_job, job_id, _job_secrets.get(job_id))
+
+    def on_done(f):
+        global _executor
+        _job_secrets.pop(job_id, None)
+        # Future bị hủy khi shutdown: job vẫn ở hàng đợi và được chạy lại lúc khởi động
+        if f.cancelled() or f.exception() is None:
+            return
+
+        error = f.exception()
+        print(f"Job {job_id} crashed: {error}")
+        # Process worker chết (OOM, bị kill) làm hỏng cả pool, lần submit sau sẽ tạo pool mới
+        if isinstance(error, BrokenProcessPool) and _executor is executor:
+            _executor = None
+
+        # Đánh dấu failed để manager có thể gọi /jobs/{id}/retry/ ngay, không phải chờ khởi động lại
+        get_database()["jobs"].update_one(
+            {"job_id": job_id, "status": {"$in": ["queued", "running", "retrying"]}},
+            {"$set": {
+                "status": "failed",
+                "error": f"Worker crashed: {error}",
+                "updated_at": datetime.now(timezone.utc)
+            }}
+        )
+
+    future.add_done_callback(on_done)
+
+
+def retry_job(db, job_id: str) -> bool:
+    job = db["jobs"].find_one_and_update(
+        {"job_id": job_id, "status": "failed"},
+        {
+            "$set": {
+                "status": "queued",
+                "error": None,
+                "progress": {"done": 0, "total": 0},
+                "updated_at": datetime.now(timezone.utc)
+            },
+            # Giữ nguyên attempts để handler biết đây là lần chạy lại
+            "$inc": {"max_attempts": JOB_MAX_ATTEMPTS}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+    if not job:
+        return False
+    submit_job(job_id)
+    return True
+
+
+def resume_pending_jobs(db):
+    # Job đang chạy dở khi process cũ chết sẽ được đưa lại vào hàng đợi
+    stale_before = datetime.now(
+        timezone.utc) - timedelta(seconds=JOB_STALE_SECONDS)
+    db["jobs"].update_many(
+        {"status": "running", "updated_at": {"$lt": stale_before}},
+        {"$set": {"status": "queued", "updated_at": datetime.now(timezone.utc)}}
+    )
+
+    for job in db["jobs"].find({"status": {"$in": ["queued", "retrying"]}}, projection={"job_id": 1}):
+        submit_job(job["job_id"])
+
+
+def run_job(job_id: str, secrets: dict | None = None):
+    # Hàm này chạy trong process worker
+    db = get_database()
+
+    while True:
+        # Chiếm job một cách nguyên tử để hai worker không chạy trùng
+        job = db["jobs"].find_one_and_update(
+            {"job_id": job_id, "status": {"$in": ["queued", "retrying"]}},
+            {
+                "$set": {"status": "running", "updated_at": datetime.now(timezone.utc)},
+                "$inc": {"attempts": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return
+
+        handler = JOB_HANDLERS[job["job_type"]]
+        try:
+            result = asyncio.run(handler(
+                db, job["payload"], secrets, _progress_reporter(db, job_id),
+                is_retry=job["attempts"] > 1))
+        except HTTPException as e:
+            # Lỗi nghiệp vụ (4xx) sẽ không tự khỏi nên không retry
+            _finish_job(db, job_id, "failed", error=str(e.detail))
+            return
+        except Exception as e:
+            if job["attempts"] >= job["max_attempts"]:
+                _finish_job(db, job_id, "failed", error=str(e))
+                return
+            db["jobs"].update_one(
+                {"job_id": job_id},
+                {"$set": {"status": "retrying", "error": str(e),
+                          "updated_at": datetime.now(timezone.utc)}}
+            )
+            time.sleep(JOB_RETRY_BACKOFF_SECONDS * job["attempts"])
+            continue
+
+        _finish_job(db, job_id, "completed", result=result)
+        return
+
+
+def _finish_job(db, job_id: str, job_status: str, result=None, error: str | None = None):
+    db["jobs"].update_one(
+        {"job_id": job_id},
+        {"$set": {
+            "status": job_status,
+            "result": result,
+            "error": error,
+            "updated_at": datetime.now(timezone.utc)
+        }}
+    )
+
+
+def _progress_reporter(db, job_id: str):
+    last_report = 0.0
+
+    def report(done: int, total: int):
+        nonlocal last_report
+        # Giới hạn số lần ghi tiến độ để không nhân đôi số round trip của job
+        now = time.monotonic()
+        if done < total and now - last_report < JOB_PROGRESS_INTERVAL_SECONDS:
+            return
+        last_report = now
+        db["jobs"].update_one(
+            {"job_id": job_id},
+            {"$set": {
+                "progress": {"done": done, "total": total},
+                "updated_at": datetime.now(timezone.utc)
+            }}
+        )
+
+    return report
+
+
+async def _approve_worked_shifts_job(db, payload: dict, secrets, report_progress, is_retry: bool):
+    shifts = payload["shifts"]
+    for index, shift in enumerate(shifts, start=1):
+        # Lần chạy đầu giống đường inline (ca đã done trả về 404);
+        # lần chạy lại bỏ qua các ca mà lần trước đã duyệt
+        approve_worked_shift(db, shift, allow_done=is_retry)
+        report_progress(index, len(shifts))
+    return {"approved": len(shifts)}
+
+
+async def _approve_assign_table_job(db, payload: dict, secrets, report_progress, is_retry: bool):
+    report_progress(0, 1)
+    table_id = create_assign_table(db, payload["shifts"], payload["manager"])
+    report_progress(1, 1)
+    return {"table_id": table_id}
+
+
+async def _create_accounts_job(db, payload: dict, secrets, report_progress, is_retry: bool):
+    if not secrets:
+        raise HTTPException(
+            status_code=409,
+            detail="Account passwords are not persisted; submit the accounts again."
+        )
+
+    accounts = payload["accounts"]
+    results = []
+    for index, account in enumerate(accounts, start=1):
+        try:
+            user_id = await create_user_account(
+                db,
+                account["username"],
+                account["email"],
+                secrets["passwords"][account["username"]],
+                account["manager"],
+                payload["manager_username"]
+            )
+            results.append(
+                {"username": account["username"], "user_id": user_id})
+        except HTTPException as e:
+            # Lỗi của từng tài khoản được ghi lại, không làm hỏng cả job
+            results.append(
+                {"username": account["username"], "error": e.detail})
+        report_progress(index, len(accounts))
+    return {"accounts": results}
+
+
+JOB_HANDLERS = {
+    "approve_worked_shifts": _approve_worked_shifts_job,
+    "approve_assign_table": _approve_assign_table_job,
+    "create_accounts": _create_accounts_job,
+}
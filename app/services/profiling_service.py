@@ -0,0 +1,215 @@
+import json
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+
+from pymongo import monitoring
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_REPORT_DIR = Path(os.getenv("PROFILE_REPORT_DIR", "profiles"))
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(
+    os.getenv("PROFILE_SAMPLE_INTERVAL_SECONDS", 0.005))
+# Giới hạn số báo cáo và tuổi báo cáo để thư mục không phình ra khi bật trên production
+PROFILE_MAX_REPORTS = int(os.getenv("PROFILE_MAX_REPORTS", 200))
+PROFILE_MAX_AGE_SECONDS = int(
+    os.getenv("PROFILE_MAX_AGE_SECONDS", 7 * 24 * 60 * 60))
+PROFILE_HEADER = "X-Profile-Request"
+REPORT_KINDS = {"collapsed": "text/plain", "json": "application/json"}
+# File tóm tắt nhỏ để liệt kê báo cáo mà không phải đọc cả timeline
+SUMMARY_KIND = "summary"
+
+# Profile của request hiện tại, được truyền sang threadpool cùng với context
+_current_profile: ContextVar["RequestProfile | None"] = ContextVar(
+    "current_profile", default=None)
+
+
+class SamplingProfiler(threading.Thread):
+    # Lấy mẫu stack của mọi thread theo chu kỳ và gom lại ở dạng collapsed stacks
+    def __init__(self, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        thread_names = {}
+        while not self._stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                thread_names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                self.samples[_collapse_stack(
+                    thread_names.get(thread_id, str(thread_id)), frame)] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, username: str):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.username = username
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.status_code = None
+        self.commands = []
+        self._pending_commands = {}
+        self._lock = threading.Lock()
+        self.profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL_SECONDS)
+
+    def command_started(self, event):
+        with self._lock:
+            self._pending_commands[event.request_id] = {
+                "command_name": event.command_name,
+                "database": event.database_name,
+                "collection": _command_collection(event),
+                "start_ms": round((time.perf_counter() - self.started) * 1000, 3)
+            }
+
+    def command_finished(self, event, succeeded: bool):
+        with self._lock:
+            command = self._pending_commands.pop(event.request_id, None)
+            if command is None:
+                return
+            command["duration_ms"] = round(event.duration_micros / 1000, 3)
+            command["succeeded"] = succeeded
+            self.commands.append(command)
+
+
+class ProfilingCommandListener(monitoring.CommandListener):
+    # Ghi lại các lệnh MongoDB phát sinh trong request đang được profile
+    def started(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.command_started(event)
+
+    def succeeded(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.command_finished(event, succeeded=True)
+
+    def failed(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile.command_finished(event, succeeded=False)
+
+
+profiling_listener = ProfilingCommandListener()
+
+
+def start_profile(method: str, path: str, username: str) -> RequestProfile:
+    profile = RequestProfile(method, path, username)
+    # Context của mỗi request là bản sao riêng nên không cần reset sau khi xong
+    _current_profile.set(profile)
+    profile.profiler.start()
+    return profile
+
+
+def finish_profile(profile: RequestProfile, status_code: int | None):
+    profile.profiler.stop()
+    profile.duration_ms = round(
+        (time.perf_counter() - profile.started) * 1000, 3)
+    profile.status_code = status_code
+    write_report(profile)
+
+
+def write_report(profile: RequestProfile):
+    PROFILE_REPORT_DIR.mkdir(parents=True, exist_ok=True)
+
+    collapsed = "".join(
+        f"{stack} {count}\n" for stack, count in profile.profiler.samples.most_common())
+    (PROFILE_REPORT_DIR / f"{profile.profile_id}.collapsed").write_text(collapsed)
+
+    summary = {
+        "profile_id": profile.profile_id,
+        "method": profile.method,
+        "path": profile.path,
+        "username": profile.username,
+        "started_at": profile.started_at.isoformat(),
+        "duration_ms": profile.duration_ms,
+        "status_code": profile.status_code,
+        "sample_interval_ms": PROFILE_SAMPLE_INTERVAL_SECONDS * 1000,
+        "sample_count": sum(profile.profiler.samples.values()),
+        "command_count": len(profile.commands),
+        "command_time_ms": round(sum(c["duration_ms"] for c in profile.commands), 3)
+    }
+    report = {
+        **summary,
+        "commands": sorted(profile.commands, key=lambda c: c["start_ms"])
+    }
+    (PROFILE_REPORT_DIR / f"{profile.profile_id}.json").write_text(
+        json.dumps(report, indent=2))
+    # Ghi file tóm tắt sau cùng: báo cáo chỉ xuất hiện trong danh sách khi đã ghi đủ
+    (PROFILE_REPORT_DIR / f"{profile.profile_id}.{SUMMARY_KIND}").write_text(
+        json.dumps(summary))
+
+    prune_reports()
+
+
+def prune_reports():
+    # Xóa báo cáo quá hạn và báo cáo cũ nhất khi vượt quá số lượng, chỉ dựa vào mtime
+    summaries = sorted(
+        PROFILE_REPORT_DIR.glob(f"*.{SUMMARY_KIND}"),
+        key=lambda path: path.stat().st_mtime,
+        reverse=True
+    )
+    expired_before = time.time() - PROFILE_MAX_AGE_SECONDS
+    for index, path in enumerate(summaries):
+        if index >= PROFILE_MAX_REPORTS or path.stat().st_mtime < expired_before:
+            for kind in [SUMMARY_KIND, *REPORT_KINDS]:
+                path.with_suffix(f".{kind}").unlink(missing_ok=True)
+
+
+def list_reports() -> list[dict]:
+    if not PROFILE_REPORT_DIR.exists():
+        return []
+
+    reports = []
+    for path in PROFILE_REPORT_DIR.glob(f"*.{SUMMARY_KIND}"):
+        try:
+            reports.append(json.loads(path.read_text()))
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Báo cáo vừa bị xóa bởi worker khác
+            continue
+    return sorted(reports, key=lambda r: r["started_at"], reverse=True)
+
+
+def get_report_path(profile_id: str, kind: str) -> Path | None:
+    # profile_id chỉ gồm ký tự hex để không thể thoát ra ngoài thư mục báo cáo
+    if kind not in REPORT_KINDS or len(profile_id) != 32:
+        return None
+    if any(ch not in "0123456789abcdef" for ch in profile_id):
+        return None
+    path = PROFILE_REPORT_DIR / f"{profile_id}.{kind}"
+    return path if path.exists() else None
+
+
+def _collapse_stack(thread_name: str, frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(
+            f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.append(thread_name)
+    # Định dạng collapsed: từ gốc đến lá, ngăn cách bởi dấu chấm phẩy
+    return ";".join(reversed(stack)).replace(" ", "_")
+
+
+def _command_collection(event) -> str | None:
+    value = event.command.get(event.command_name)
+    return value if isinstance(value, str) else None
@@ -0,0 +1,152 @@
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from pymongo import monitoring
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 120))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", 30))
+LOGIN_RATE_LIMIT_PER_MINUTE = float(
+    os.getenv("LOGIN_RATE_LIMIT_PER_MINUTE", 10))
+LOGIN_RATE_LIMIT_BURST = int(os.getenv("LOGIN_RATE_LIMIT_BURST", 10))
+# Handler async gọi pymongo đồng bộ chặn event loop, lệnh song song chỉ đến từ
+# dependency/stream chạy trong threadpool 40 luồng của anyio, nên ngưỡng phải dưới mức đó
+LOAD_SHED_MAX_INFLIGHT_DB_OPS = int(
+    os.getenv("LOAD_SHED_MAX_INFLIGHT_DB_OPS", 32))
+# Request đã nhận nhưng chưa trả response (kể cả đang chờ event loop)
+LOAD_SHED_MAX_INFLIGHT_REQUESTS = int(
+    os.getenv("LOAD_SHED_MAX_INFLIGHT_REQUESTS", 64))
+LOAD_SHED_RETRY_AFTER_SECONDS = int(
+    os.getenv("LOAD_SHED_RETRY_AFTER_SECONDS", 1))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second: float, capacity: int):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def consume(self) -> float:
+        # Trả về 0 nếu được phép, ngược lại là số giây cần chờ để có token tiếp theo
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate_per_second
+
+
+class RateLimiter:
+    def __init__(self, per_minute: float, burst: int, max_keys: int = 10000):
+        self.rate_per_second = per_minute / 60
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> float:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate_per_second, self.burst)
+                self._buckets[key] = bucket
+                # Bỏ bucket ít dùng nhất để bộ nhớ không tăng theo số IP
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.consume()
+
+
+class InFlightCommandCounter(monitoring.CommandListener):
+    # Đếm số lệnh MongoDB đang chạy, dùng cho load shedding
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def started(self, event):
+        with self._lock:
+            self.in_flight += 1
+
+    def succeeded(self, event):
+        self._done()
+
+    def failed(self, event):
+        self._done()
+
+    def _done(self):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+
+class InFlightRequestCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def acquire(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+
+class RejectionCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def increment(self, reason: str):
+        with self._lock:
+            self._counts[reason] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+request_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST)
+login_limiter = RateLimiter(LOGIN_RATE_LIMIT_PER_MINUTE,
+                            LOGIN_RATE_LIMIT_BURST)
+in_flight_counter = InFlightCommandCounter()
+in_flight_requests = InFlightRequestCounter()
+rejection_counters = RejectionCounters()
+
+
+def check_rate_limits(client_ip: str, username: str | None, is_login: bool) -> tuple[str, float] | None:
+    # Trả về (lý do, số giây chờ) của giới hạn bị vượt, hoặc None nếu được phép
+    if is_login:
+        retry_after = login_limiter.hit(f"ip:{client_ip}")
+        if retry_after:
+            return "login_rate_limited", retry_after
+
+    # Request đã xác thực được giới hạn theo user để nhân viên dùng chung Wi-Fi
+    # cửa hàng (chung IP) không chặn lẫn nhau; request ẩn danh giới hạn theo IP
+    if username:
+        reason, key = "user_rate_limited", f"user:{username}"
+    else:
+        reason, key = "ip_rate_limited", f"ip:{client_ip}"
+    retry_after = request_limiter.hit(key)
+    if retry_after:
+        return reason, retry_after
+    return None
+
+
+def should_shed_load() -> bool:
+    return (in_flight_requests.in_flight >= LOAD_SHED_MAX_INFLIGHT_REQUESTS
+            or in_flight_counter.in_flight >= LOAD_SHED_MAX_INFLIGHT_DB_OPS)
+
+
+def retry_after_header(seconds: float) -> str:
+    return str(max(1, math.ceil(seconds)))
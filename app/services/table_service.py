@@ -1,19 +1,32 @@
-from pymongo import DESCENDING
+from datetime import datetime, timezone
+from fastapi import HTTPException, status
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
+from app.dependencies import is_duplicate_key
+from app.services.availability_service import build_assign_bitmaps
+from app.services.cache_service import assign_table_cache, user_cache
 
-def generate_table_id(db, table_type: str) -> str:
+
+def get_table_id_prefix(table_type: str) -> str:
     # Đặt tiền tố cho table_id dựa trên loại bảng
-    prefix = "TR" if table_type == "register" else "TA"
+    return "TR" if table_type == "register" else "TA"
+
 
+def get_last_table_number(db, prefix: str) -> int:
     # Aggregation pipeline để tìm table có table_id bắt đầu bằng tiền tố
     pipeline = [
         {
             "$match": {
-                "table_id": {"$regex": f"^{prefix}\\d{{3}}$"}
+                "table_id": {"$regex": f"^{prefix}\\d{{3,}}$"}
             }
         },
         {
-            "$sort": {"table_id": DESCENDING}  # Sắp xếp theo table_id giảm dần
+            # Sắp xếp theo độ dài rồi theo table_id để TA1000 đứng sau TA999
+            "$addFields": {"table_id_length": {"$strLenCP": "$table_id"}}
+        },
+        {
+            "$sort": {"table_id_length": DESCENDING, "table_id": DESCENDING}
         },
         {
             "$limit": 1  # Chỉ lấy table có table_id lớn nhất
@@ -25,11 +38,456 @@ def generate_table_id(db, table_type: str) -> str:
     if result:
         last_table_id = result[0]["table_id"]  # Lấy table_id cuối cùng
         # Lấy phần số của table_id (bỏ ký tự tiền tố)
-        last_number = int(last_table_id[2:])
-        new_number = last_number + 1  # Tăng số lên 1
-    else:
-        new_number = 1  # Nếu không tìm thấy table nào, bắt đầu từ T001
+        return int(last_table_id[2:])
+    return 0  # Nếu không tìm thấy table nào, bắt đầu từ 001
+
+
+def seed_table_id_counters(db):
+    # Đồng bộ bộ đếm với table_id lớn nhất hiện có ($max nên chạy nhiều lần vẫn an toàn)
+    for table_type in ["register", "assign"]:
+        prefix = get_table_id_prefix(table_type)
+        db["counters"].update_one(
+            {"_id": f"table_id_{prefix}"},
+            {"$max": {"seq": get_last_table_number(db, prefix)}},
+            upsert=True
+        )
+
+
+def generate_table_id(db, table_type: str) -> str:
+    prefix = get_table_id_prefix(table_type)
+
+    # Tăng bộ đếm một cách nguyên tử, hai request đồng thời không thể nhận cùng một id
+    counter = db["counters"].find_one_and_update(
+        {"_id": f"table_id_{prefix}"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
 
     # Format lại thành tiền tố và số mới
-    new_table_id = f"{prefix}{new_number:03d}"
+    new_table_id = f"{prefix}{counter['seq']:03d}"
     return new_table_id
+
+
+def insert_table(db, table: dict) -> str:
+    try:
+        db["tables"].insert_one(table)
+    except DuplicateKeyError as e:
+        if not is_duplicate_key(e, "table_id"):
+            raise
+        # table_id trùng nghĩa là bộ đếm chưa được đồng bộ (seed lỗi lúc khởi động):
+        # đồng bộ lại rồi cấp id mới một lần
+        seed_table_id_counters(db)
+        table["table_id"] = generate_table_id(db, table["table_type"])
+        db["tables"].insert_one(table)
+    return table["table_id"]
+
+
+def backfill_table_years(db):
+    # Table tạo trước khi có trường year: lấy năm từ ngày tạo để unique index theo năm áp dụng được
+    for table in db["tables"].find(
+        {"year": {"$exists": False}, "date": {"$type": "date"}},
+        projection={"date": 1}
+    ):
+        try:
+            db["tables"].update_one(
+                {"_id": table["_id"]},
+                {"$set": {"year": table["date"].year}}
+            )
+        except DuplicateKeyError:
+            # Dữ liệu cũ đã bị trùng tuần, giữ nguyên để manager tự xử lý
+            print(f"Duplicate table for the same week, year not set: {table['_id']}")
+
+
+# Các field client được phép chọn qua tham số fields=
+TABLE_FIELDS = {"table_id", "table_type", "week", "date",
+                "user_details", "shifts", "employee_usernames", "modify_history"}
+SHIFT_FIELDS = {"shift_name", "date", "duration", "username", "status"}
+
+
+def build_fields_projection(fields: str | None, required: set[str] = set()) -> dict | None:
+    # Chuyển "table_id,shifts.username" thành projection của MongoDB
+    if not fields:
+        return None
+
+    projection = {"_id": 0}
+    for field in [f.strip() for f in fields.split(",") if f.strip()] + sorted(required):
+        top_level, _, sub_field = field.partition(".")
+        if top_level not in TABLE_FIELDS or (sub_field and (top_level != "shifts" or sub_field not in SHIFT_FIELDS)):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown field '{field}'."
+            )
+        projection[field] = 1
+
+    # "shifts" và "shifts.xxx" cùng lúc sẽ bị MongoDB báo path collision
+    if "shifts" in projection:
+        projection = {k: v for k, v in projection.items()
+                      if not k.startswith("shifts.")}
+    return projection
+
+
+def collect_usernames(tables) -> list[str]:
+    # Lấy mọi username được tham chiếu trong các table (người tạo, các ca, danh sách nhân viên)
+    usernames = []
+    for table in tables:
+        if not table:
+            continue
+        user_details = table.get("user_details") or {}
+        if user_details.get("username"):
+            usernames.append(user_details["username"])
+        for shift in table.get("shifts") or []:
+            if shift.get("username"):
+                usernames.append(shift["username"])
+        usernames.extend(table.get("employee_usernames") or [])
+    return list(dict.fromkeys(usernames))
+
+
+def build_week_range_pipeline(table_type: str, from_week: int, to_week: int, year: int, username: str | None = None, shift_name: str | None = None, projection: dict | None = None) -> list:
+    pipeline = [
+        {
+            "$match": {
+                "table_type": table_type,
+                # Số tuần lặp lại mỗi năm nên phải lọc theo năm
+                "year": year,
+                "week": {"$gte": from_week, "$lte": to_week}
+            }
+        },
+        {"$sort": {"week": 1, "_id": 1}}
+    ]
+
+    # Lọc ca ngay trên server bằng $filter để không phải tải các ca không cần
+    shift_conditions = []
+    if username:
+        shift_conditions.append({"$eq": ["$$shift.username", username]})
+    if shift_name:
+        shift_conditions.append({"$eq": ["$$shift.shift_name", shift_name]})
+
+    if shift_conditions:
+        pipeline.append({
+            "$addFields": {
+                "shifts": {
+                    "$filter": {
+                        "input": "$shifts",
+                        "as": "shift",
+                        "cond": {"$and": shift_conditions}
+                    }
+                }
+            }
+        })
+
+    pipeline.append({"$project": projection or {"_id": 0}})
+    return pipeline
+
+
+WEEK_IN_MILLISECONDS = 7 * 24 * 60 * 60 * 1000
+# Tuần tính theo (ngày trong năm // 7) + 1 nên lớn nhất là tuần 53
+MAX_WEEK_NUMBER = 53
+
+
+def build_copy_assign_pipeline(source_week: int, offset: int, year: int, table_id: str, manager: dict, drop_inactive: bool) -> list:
+    pipeline = [
+        # Unique index (manager, week, year) nên chỉ có một assign table nguồn
+        {
+            "$match": {
+                "table_type": "assign",
+                "user_details.username": manager["username"],
+                "week": source_week,
+                "year": year
+            }
+        }
+    ]
+
+    shifts = "$shifts"
+    employee_usernames = "$employee_usernames"
+    bitmaps = {"$ifNull": ["$bitmaps", []]}
+
+    if drop_inactive:
+        # Nhân viên còn hoạt động: tài khoản còn tồn tại và vẫn thuộc manager hiện tại
+        pipeline.extend([
+            {
+                "$lookup": {
+                    "from": "users",
+                    "let": {"usernames": {"$ifNull": ["$employee_usernames", []]}},
+                    "pipeline": [
+                        {
+                            "$match": {
+                                "$expr": {"$in": ["$username", "$$usernames"]},
+                                "manager_username": manager["username"]
+                            }
+                        },
+                        {"$project": {"_id": 0, "username": 1}}
+                    ],
+                    "as": "active_users"
+                }
+            },
+            {"$set": {"active_usernames": "$active_users.username"}}
+        ])
+        shifts = {
+            "$filter": {
+                "input": "$shifts",
+                "as": "shift",
+                "cond": {"$in": ["$$shift.username", "$active_usernames"]}
+            }
+        }
+        employee_usernames = {
+            "$filter": {
+                "input": "$employee_usernames",
+                "as": "username",
+                "cond": {"$in": ["$$username", "$active_usernames"]}
+            }
+        }
+        bitmaps = {
+            "$filter": {
+                "input": bitmaps,
+                "as": "bitmap",
+                "cond": {"$in": ["$$bitmap.username", "$active_usernames"]}
+            }
+        }
+
+    pipeline.extend([
+        {
+            "$project": {
+                "_id": 0,
+                "table_id": {"$literal": table_id},
+                "table_type": "assign",
+                "week": {"$literal": source_week + offset},
+                # Không sang năm mới (đã kiểm tra tuần đích) nên giữ năm của tuần nguồn
+                "year": {"$literal": year},
+                "date": "$$NOW",
+                "user_details": {"$literal": manager},
+                # Dời ngày của từng ca sang tuần mới và đặt lại trạng thái
+                "shifts": {
+                    "$map": {
+                        "input": shifts,
+                        "as": "shift",
+                        "in": {
+                            "shift_name": "$$shift.shift_name",
+                            "date": {"$add": ["$$shift.date", offset * WEEK_IN_MILLISECONDS]},
+                            "duration": "$$shift.duration",
+                            "username": "$$shift.username",
+                            "status": "undone"
+                        }
+                    }
+                },
+                "employee_usernames": employee_usernames,
+                "modify_history": {"$literal": []},
+                # Dời đúng số tuần nên ngày trong tuần không đổi, bitmap giữ nguyên
+                "bitmaps": bitmaps
+            }
+        },
+        {
+            # $merge vào chính collection đang aggregate cần MongoDB 4.4+.
+            # _id luôn mới nên mọi document đều được insert; unique index (manager, week, year)
+            # của assign table mới là thứ chặn hai lần copy vào cùng một tuần
+            "$merge": {
+                "into": "tables",
+                "whenMatched": "fail",
+                "whenNotMatched": "insert"
+            }
+        }
+    ])
+    return pipeline
+
+
+def copy_assign_table(db, source_week: int, offset: int, year: int, manager: dict, drop_inactive: bool) -> str:
+    target_week = source_week + offset
+    table_id = generate_table_id(db, "assign")
+    for attempt in range(2):
+        try:
+            db["tables"].aggregate(build_copy_assign_pipeline(
+                source_week, offset, year, table_id, manager, drop_inactive))
+            break
+        except DuplicateKeyError as e:
+            if attempt == 0 and is_duplicate_key(e, "table_id"):
+                # Bộ đếm chưa được đồng bộ: đồng bộ lại rồi copy với id mới
+                seed_table_id_counters(db)
+                table_id = generate_table_id(db, "assign")
+                continue
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Assign table for week {target_week} already exists."
+            )
+
+    assign_table_cache.delete(target_week)
+    return table_id
+
+
+def create_assign_table(db, shifts: list[dict], manager: dict) -> str:
+    # Tạo table_id mới cho assign table
+    table_id = generate_table_id(db, "assign")
+
+    # Giả sử current_date có múi giờ (offset-aware datetime)
+    current_date = datetime.now(timezone.utc)  # Có thể có timezone info
+
+    # year_start là ngày đầu tiên của năm, giả sử không có múi giờ (offset-naive datetime)
+    year_start = datetime(current_date.year, 1, 1)
+
+    # Chuyển đổi current_date thành offset-naive để tránh lỗi
+    current_date_naive = current_date.replace(tzinfo=None)
+
+    # Tính số tuần kể từ đầu năm
+    week_number = ((current_date_naive - year_start).days // 7) + 1
+
+    # Danh sách username từ shifts
+    employee_usernames = []
+    shifts_with_status = []
+
+    for shift in shifts:
+        # Thêm trường status vào shift
+        shift_dict = dict(shift)
+        shift_dict["status"] = "undone"
+        shifts_with_status.append(shift_dict)
+
+        if shift["username"] not in employee_usernames:
+            employee_usernames.append(shift["username"])
+
+    # Xây dựng dữ liệu cho assign table
+    assign_table = {
+        "table_id": table_id,
+        "table_type": "assign",
+        "week": week_number,
+        "year": current_date.year,
+        "date": current_date,
+        "user_details": {
+            "user_id": manager["user_id"],
+            "username": manager["username"]
+        },
+        "shifts": shifts_with_status,
+        "employee_usernames": employee_usernames,
+        "bitmaps": build_assign_bitmaps(shifts_with_status)
+    }
+
+    # Chèn assign table vào MongoDB, unique index (manager, week, year) chặn assign table thứ hai của tuần
+    try:
+        table_id = insert_table(db, assign_table)
+    except DuplicateKeyError:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Assign table for week {week_number} already exists."
+        )
+    assign_table_cache.delete(week_number)
+    return table_id
+
+
+def get_assign_table(db, week_number: int) -> dict | None:
+    # Assign table của một tuần được đọc nhiều hơn ghi nhiều lần nên đọc qua cache
+    assign_table = assign_table_cache.get(week_number)
+    if assign_table is None:
+        assign_table = db["tables"].find_one(
+            {"table_type": "assign", "week": week_number},
+            projection={"_id": 0}
+        )
+        if assign_table is not None:
+            assign_table_cache.set(week_number, assign_table)
+    return assign_table
+
+
+def get_current_week() -> tuple[int, int]:
+    # Cùng cách tính tuần với submit_register_table và create_assign_table
+    current_date = datetime.now(timezone.utc).replace(tzinfo=None)
+    year_start = datetime(current_date.year, 1, 1)
+    return ((current_date - year_start).days // 7) + 1, current_date.year
+
+
+def _normalize_date(date: datetime) -> datetime:
+    # MongoDB trả về datetime naive theo UTC, client có thể gửi datetime có múi giờ
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def find_assignment_violations(db, shifts: list[dict], manager_username: str, week_number: int, year: int) -> list[dict]:
+    # Kiểm tra cả danh sách bằng đúng 2 truy vấn, không phụ thuộc số ca
+    usernames = list({shift["username"] for shift in shifts})
+    users = {
+        user["username"]: user for user in db["users"].find(
+            {"username": {"$in": usernames}},
+            projection={"_id": 0, "username": 1, "manager_username": 1}
+        )
+    }
+
+    registered_shifts = set()
+    for register_table in db["tables"].find(
+        {
+            "table_type": "register",
+            "week": week_number,
+            # Register table cũ chưa có trường year
+            "year": {"$in": [year, None]},
+            "user_details.username": {"$in": usernames}
+        },
+        projection={"_id": 0, "user_details.username": 1,
+                    "shifts.shift_name": 1, "shifts.date": 1}
+    ):
+        username = register_table["user_details"]["username"]
+        for shift in register_table.get("shifts", []):
+            registered_shifts.add(
+                (username, shift["shift_name"], _normalize_date(shift["date"])))
+
+    violations = []
+    for index, shift in enumerate(shifts):
+        date = _normalize_date(shift["date"])
+        user = users.get(shift["username"])
+        if user is None:
+            reason = "unknown_user"
+        elif user.get("manager_username") != manager_username:
+            reason = "not_in_store"
+        elif (shift["username"], shift["shift_name"], date) not in registered_shifts:
+            reason = "not_registered"
+        else:
+            continue
+        violations.append({
+            "index": index,
+            "username": shift["username"],
+            "shift_name": shift["shift_name"],
+            "date": date.isoformat(),
+            "reason": reason
+        })
+    return violations
+
+
+def validate_assignments(db, shifts: list[dict], manager_username: str, week_number: int, year: int):
+    # Trả về mọi lỗi trong một response để manager sửa một lần
+    violations = find_assignment_violations(
+        db, shifts, manager_username, week_number, year)
+    if violations:
+        raise HTTPException(
+            status_code=422,
+            detail={"msg": "Some shifts cannot be assigned.",
+                    "violations": violations}
+        )
+
+
+def approve_worked_shift(db, shift: dict, allow_done: bool = False):
+    # allow_done=True cho phép chạy lại (retry job) mà không báo lỗi hay ghi trùng worked_shifts
+    # Update assign table: find the shift and mark it as 'done'
+    # Lấy kèm week của assign table để bỏ đúng cache
+    shift_filter = {"shift_name": shift["shift_name"], "date": shift["date"]}
+    if not allow_done:
+        shift_filter["status"] = {"$ne": "done"}
+    assign_table = db["tables"].find_one_and_update(
+        {"table_type": "assign", "shifts": {"$elemMatch": shift_filter}},
+        {"$set": {"shifts.$.status": "done"}},
+        projection={"_id": 0, "week": 1}
+    )
+
+    if assign_table is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Shift not found for {shift['shift_name']} on {shift['date']}"
+        )
+    assign_table_cache.delete(assign_table["week"])
+
+    # Add shift to employee's worked_shifts
+    db["users"].update_one(
+        {"username": shift["username"]},
+        {
+            "$addToSet" if allow_done else "$push": {
+                "worked_shifts": {
+                    "shift_name": shift["shift_name"],
+                    "date": shift["date"],
+                }
+            }
+        }
+    )
+    user_cache.delete(shift["username"])
@@ -1,22 +1,25 @@
-from fastapi import Depends
-from pymongo import DESCENDING
+from fastapi import Depends, HTTPException
+from pymongo import DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
-from app.dependencies import get_database
+from app.dependencies import get_database, is_duplicate_key
 from app.models.user_model import ClientUser
-from app.services.auth_service import get_current_user
+from app.services.auth_service import get_current_user, get_password_hash
 
 
-async def generate_employee_user_id(db):
-    # Aggregation pipeline để tìm user có user_id bắt đầu bằng "E", sắp xếp theo user_id giảm dần
+def get_last_user_number(db, prefix: str) -> int:
+    # Tìm user_id lớn nhất có dạng <prefix>XXX, sắp theo độ dài trước để E1000 đứng sau E999
     pipeline = [
         {
             "$match": {
-                # Lọc những user_id có format EXXX
-                "user_id": {"$regex": "^E\\d{3}$"}
+                "user_id": {"$regex": f"^{prefix}\\d{{3,}}$"}
             }
         },
         {
-            "$sort": {"user_id": DESCENDING}  # Sắp xếp theo user_id giảm dần
+            "$addFields": {"user_id_length": {"$strLenCP": "$user_id"}}
+        },
+        {
+            "$sort": {"user_id_length": DESCENDING, "user_id": DESCENDING}
         },
         {
             "$limit": 1  # Chỉ lấy user có user_id lớn nhất
@@ -26,45 +29,150 @@ async def generate_employee_user_id(db):
     result = list(db["users"].aggregate(pipeline))
 
     if result:
-        last_user_id = result[0]["user_id"]  # Lấy user_id cuối cùng
-        # Lấy phần số của user_id (bỏ ký tự "E")
-        last_number = int(last_user_id[1:])
-        new_number = last_number + 1  # Tăng số lên 1
-    else:
-        new_number = 1  # Nếu không tìm thấy user nào, bắt đầu từ E001
-
-    # Format lại thành EXXX
-    new_user_id = f"E{new_number:03d}"
-    return new_user_id
+        # Lấy phần số của user_id (bỏ ký tự tiền tố)
+        return int(result[0]["user_id"][1:])
+    return 0  # Nếu không tìm thấy user nào, bắt đầu từ 001
+
+
+def seed_user_id_counters(db):
+    # Đồng bộ bộ đếm với user_id lớn nhất hiện có ($max nên chạy nhiều lần vẫn an toàn)
+    for prefix in ["E", "M"]:
+        db["counters"].update_one(
+            {"_id": f"user_id_{prefix}"},
+            {"$max": {"seq": get_last_user_number(db, prefix)}},
+            upsert=True
+        )
+
+
+def generate_user_id(db, prefix: str) -> str:
+    # Tăng bộ đếm một cách nguyên tử, request và job tạo tài khoản đồng thời không nhận trùng id
+    counter = db["counters"].find_one_and_update(
+        {"_id": f"user_id_{prefix}"},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+    # Format lại thành <prefix>XXX
+    return f"{prefix}{counter['seq']:03d}"
+
+
+async def generate_employee_user_id(db):
+    return generate_user_id(db, "E")
 
 
 async def generate_manager_user_id(db):
-    # Aggregation pipeline để tìm user có user_id bắt đầu bằng "M", sắp xếp theo user_id giảm dần
-    pipeline = [
-        {
-            "$match": {
-                # Lọc những user_id có format MXXX
-                "user_id": {"$regex": "^M\\d{3}$"}
-            }
-        },
-        {
-            "$sort": {"user_id": DESCENDING}  # Sắp xếp theo user_id giảm dần
-        },
-        {
-            "$limit": 1  # Chỉ lấy user có user_id lớn nhất
+    return generate_user_id(db, "M")
+
+
+async def create_user_account(db, username: str, email: str, password: str, manager: bool, manager_username: str) -> str:
+    # Kiểm tra xem username và email có tồn tại không
+    existing_user = db["users"].find_one({
+        "$or": [
+            {"username": username},
+            {"email": email}
+        ]
+    })
+
+    if existing_user:
+        if existing_user.get("username") == username:
+            raise HTTPException(
+                status_code=400, detail="Username already in use")
+        if existing_user.get("email") == email:
+            raise HTTPException(status_code=400, detail="Email already in use")
+
+    # Tạo user_id mới tùy thuộc vào role
+    if manager:  # Nếu tạo tài khoản Manager
+        new_user_id = await generate_manager_user_id(db)
+        role = "Manager"
+        user = {
+            "user_id": new_user_id,
+            "role": role,
+            "username": username,
+            "password": get_password_hash(password),
+            "first_name": "",
+            "last_name": "",
+            "address": "",
+            "email": email,
+            "phone_number": "",
+            "gender": None
+        }
+    else:  # Nếu tạo tài khoản Employee
+        new_user_id = await generate_employee_user_id(db)
+        role = "Employee"
+        user = {
+            "user_id": new_user_id,
+            "role": role,
+            "username": username,
+            "password": get_password_hash(password),
+            "first_name": "",
+            "last_name": "",
+            "address": "",
+            "email": email,
+            "phone_number": "",
+            "gender": None,
+            "worked_shifts": [],  # Danh sách rỗng cho Employee
+            # Lưu tên Manager tạo tài khoản
+            "manager_username": manager_username
         }
-    ]
 
-    result = list(db["users"].aggregate(pipeline))
+    # Chèn user vào MongoDB, unique index chặn trường hợp hai request tạo cùng lúc
+    try:
+        db["users"].insert_one(user)
+    except DuplicateKeyError as e:
+        if not is_duplicate_key(e, "user_id"):
+            raise HTTPException(
+                status_code=409, detail="Username or email already in use")
 
-    if result:
-        last_user_id = result[0]["user_id"]  # Lấy user_id cuối cùng
-        # Lấy phần số của user_id (bỏ ký tự "M")
-        last_number = int(last_user_id[1:])
-        new_number = last_number + 1  # Tăng số lên 1
-    else:
-        new_number = 1  # Nếu không tìm thấy user nào, bắt đầu từ E001
-
-    # Format lại thành EXXX
-    new_user_id = f"M{new_number:03d}"
+        # user_id trùng nghĩa là bộ đếm chưa được đồng bộ (seed lỗi lúc khởi động):
+        # đồng bộ lại rồi cấp id mới một lần
+        seed_user_id_counters(db)
+        user["user_id"] = new_user_id = generate_user_id(db, new_user_id[0])
+        try:
+            db["users"].insert_one(user)
+        except DuplicateKeyError:
+            raise HTTPException(
+                status_code=409, detail="Username or email already in use")
     return new_user_id
+
+
+# Các field của user được trả kèm khi client yêu cầu expand=users
+USER_DETAIL_PROJECTION = {
+    "_id": 0,
+    "user_id": 1,
+    "role": 1,
+    "username": 1,
+    "first_name": 1,
+    "last_name": 1,
+    "email": 1,
+    "phone_number": 1
+}
+
+
+class UserLoader:
+    # Gom các username cần tra cứu thành một truy vấn $in, cache trong phạm vi một request
+    def __init__(self, db):
+        self.db = db
+        self._cache: dict[str, dict | None] = {}
+
+    def load_many(self, usernames) -> dict[str, dict | None]:
+        usernames = list(dict.fromkeys(usernames))
+        missing = [
+            username for username in usernames if username not in self._cache]
+
+        if missing:
+            for user in self.db["users"].find(
+                {"username": {"$in": missing}},
+                projection=USER_DETAIL_PROJECTION
+            ):
+                self._cache[user["username"]] = user
+            # Username không còn tồn tại cũng được cache để không truy vấn lại
+            for username in missing:
+                self._cache.setdefault(username, None)
+
+        return {username: self._cache[username] for username in usernames}
+
+
+def get_user_loader(db=Depends(get_database)) -> UserLoader:
+    # FastAPI chỉ gọi dependency này một lần cho mỗi request
+    return UserLoader(db)
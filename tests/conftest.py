@@ -0,0 +1,7 @@
+import os
+
+# Phải đặt trước khi import app: app.dependencies tạo MongoClient khi import
+os.environ.setdefault("MONGO_URI", os.getenv(
+    "MONGO_TEST_URI", "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=100"))
+os.environ.setdefault("SECRET_KEY", "test-secret-key-for-signing-jwt-tokens")
+os.environ.setdefault("ALGORITHM", "HS256")
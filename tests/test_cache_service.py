@@ -0,0 +1,78 @@
+import time
+from datetime import datetime
+
+import bson
+import pytest
+
+from app.services.cache_service import CacheBackend, MemoryCacheBackend, RedisCacheBackend
+
+fakeredis = pytest.importorskip("fakeredis")
+
+
+@pytest.fixture
+def workers():
+    # Hai worker dùng chung một server Redis giả lập, mỗi worker có near-cache riêng
+    server = fakeredis.FakeServer()
+    backends = [RedisCacheBackend(fakeredis.FakeRedis(server=server), near_ttl=60)
+                for _ in range(2)]
+    yield backends
+    for backend in backends:
+        backend.close()
+
+
+def wait_until(condition, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def test_cache_backend_is_abstract():
+    with pytest.raises(TypeError):
+        CacheBackend()
+
+
+def test_memory_backend_evicts_least_recently_used_and_expires():
+    cache = MemoryCacheBackend(max_entries=2)
+    cache.set("a", {"v": 1}, ttl=60)
+    cache.set("b", {"v": 2}, ttl=60)
+    cache.get("a")
+    cache.set("c", {"v": 3}, ttl=60)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"v": 1}
+
+    cache.set("d", {"v": 4}, ttl=0)
+    assert cache.get("d") is None
+
+
+def test_memory_backend_returns_copies():
+    cache = MemoryCacheBackend()
+    cache.set("user", {"shifts": []}, ttl=60)
+    cache.get("user")["shifts"].append("x")
+
+    assert cache.get("user") == {"shifts": []}
+
+
+def test_redis_backend_shares_values_between_workers(workers):
+    first, second = workers
+    value = {"username": "alice", "date": datetime(2026, 3, 2, 8, 0)}
+    first.set("users:alice", value, ttl=60)
+
+    assert second.get("users:alice") == value
+
+
+def test_redis_backend_delete_invalidates_other_workers_near_cache(workers):
+    first, second = workers
+    first.set("assign_tables:10", {"week": 10, "status": "undone"}, ttl=60)
+    assert second.get("assign_tables:10") == {"week": 10, "status": "undone"}
+
+    # Worker thứ hai đang giữ bản near-cache; giá trị trong Redis đổi mà không báo
+    first.client.set("assign_tables:10", bson.encode({"week": 10, "status": "done"}))
+    assert second.get("assign_tables:10")["status"] == "undone"
+
+    first.delete("assign_tables:10")
+
+    assert wait_until(lambda: second.get("assign_tables:10") is None)
@@ -0,0 +1,178 @@
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
+
+from app.dependencies import ensure_indexes, get_database
+from app.main import app
+from app.services.auth_service import create_access_token
+from app.services.cache_service import MemoryCacheBackend, set_cache_backend
+from app.services.table_service import build_copy_assign_pipeline, get_current_week
+
+MONGO_TEST_URI = os.getenv("MONGO_TEST_URI")
+
+# $merge, $lookup với let và $add trên date không có trong các bản giả lập MongoDB
+pytestmark = pytest.mark.skipif(
+    not MONGO_TEST_URI, reason="set MONGO_TEST_URI to a MongoDB 4.4+ server")
+
+SOURCE_WEEK = 10
+SOURCE_DATE = datetime(2026, 3, 2)
+# Copy chỉ đọc assign table của năm hiện tại
+YEAR = get_current_week()[1]
+MANAGER = {"user_id": "M001", "username": "boss1"}
+OTHER_MANAGER = {"user_id": "M002", "username": "boss2"}
+
+
+def make_user(user_id: str, role: str, username: str, **extra) -> dict:
+    # get_current_user dựng ClientUser nên user phải có đủ các field bắt buộc
+    return {
+        "user_id": user_id,
+        "role": role,
+        "username": username,
+        "first_name": username.capitalize(),
+        "last_name": "Test",
+        "address": "1 Test Street",
+        "email": f"{username}@example.com",
+        "phone_number": "0123456789",
+        **extra
+    }
+
+
+def make_assign_table(table_id: str, manager: dict, week: int = SOURCE_WEEK, year: int = YEAR) -> dict:
+    return {
+        "table_id": table_id,
+        "table_type": "assign",
+        "week": week,
+        "year": year,
+        "date": SOURCE_DATE,
+        "user_details": manager,
+        "shifts": [
+            {"shift_name": "morning", "date": SOURCE_DATE, "duration": "4h",
+             "username": "alice", "status": "done"},
+            {"shift_name": "evening", "date": SOURCE_DATE + timedelta(days=1),
+             "duration": "4h", "username": "bobby", "status": "undone"},
+        ],
+        "employee_usernames": ["alice", "bobby"],
+        "modify_history": [{"modify_type": "add", "description": "old"}],
+        "bitmaps": [{"username": "alice", "bitmap": 1}, {"username": "bobby", "bitmap": 32}],
+    }
+
+
+@pytest.fixture
+def db():
+    client = MongoClient(MONGO_TEST_URI)
+    database = client[f"test_{uuid.uuid4().hex}"]
+    ensure_indexes(database)
+    database["users"].insert_many([
+        make_user("M001", "Manager", "boss1"),
+        make_user("M002", "Manager", "boss2"),
+        make_user("E001", "Employee", "alice", manager_username="boss1"),
+        make_user("E002", "Employee", "bobby", manager_username="other"),
+    ])
+    database["tables"].insert_one(make_assign_table("TA001", MANAGER))
+    database["counters"].insert_one({"_id": "table_id_TA", "seq": 1})
+    set_cache_backend(MemoryCacheBackend())
+    yield database
+    set_cache_backend(None)
+    client.drop_database(database.name)
+    client.close()
+
+
+@pytest.fixture
+def client(db):
+    app.dependency_overrides[get_database] = lambda: db
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+def manager_headers(username: str = "boss1"):
+    token = create_access_token({"sub": username}, ["manager"])
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_copy_shifts_dates_and_resets_state(client, db):
+    response = client.post(
+        f"/tables/copy_assign_table/{SOURCE_WEEK}/?offset=2", headers=manager_headers())
+
+    assert response.status_code == 201
+    assert response.json()["week"] == SOURCE_WEEK + 2
+    copy = db["tables"].find_one({"table_type": "assign", "week": SOURCE_WEEK + 2})
+    assert copy["table_id"] == response.json()["table_id"] == "TA002"
+    assert copy["year"] == YEAR
+    assert copy["user_details"] == MANAGER
+    assert copy["modify_history"] == []
+    assert [shift["date"] for shift in copy["shifts"]] == [
+        SOURCE_DATE + timedelta(weeks=2), SOURCE_DATE + timedelta(weeks=2, days=1)]
+    assert {shift["status"] for shift in copy["shifts"]} == {"undone"}
+    assert copy["bitmaps"] == [{"username": "alice", "bitmap": 1}, {"username": "bobby", "bitmap": 32}]
+
+
+def test_drop_inactive_keeps_only_current_employees(client, db):
+    response = client.post(
+        f"/tables/copy_assign_table/{SOURCE_WEEK}/?drop_inactive=true", headers=manager_headers())
+
+    assert response.status_code == 201
+    copy = db["tables"].find_one({"table_type": "assign", "week": SOURCE_WEEK + 1})
+    assert [shift["username"] for shift in copy["shifts"]] == ["alice"]
+    assert copy["employee_usernames"] == ["alice"]
+    assert copy["bitmaps"] == [{"username": "alice", "bitmap": 1}]
+
+
+def test_second_copy_into_same_week_conflicts(client, db):
+    assert client.post(f"/tables/copy_assign_table/{SOURCE_WEEK}/",
+                       headers=manager_headers()).status_code == 201
+    assert client.post(f"/tables/copy_assign_table/{SOURCE_WEEK}/",
+                       headers=manager_headers()).status_code == 409
+
+
+def test_last_years_tables_do_not_block_or_feed_the_copy(client, db):
+    db["tables"].insert_many([
+        make_assign_table("TA010", MANAGER, week=SOURCE_WEEK + 1, year=YEAR - 1),
+        make_assign_table("TA011", MANAGER, week=SOURCE_WEEK, year=YEAR - 1),
+    ])
+    db["counters"].update_one({"_id": "table_id_TA"}, {"$set": {"seq": 11}})
+
+    response = client.post(
+        f"/tables/copy_assign_table/{SOURCE_WEEK}/", headers=manager_headers())
+
+    assert response.status_code == 201
+    copy = db["tables"].find_one({"table_id": response.json()["table_id"]})
+    assert copy["year"] == YEAR
+    assert copy["week"] == SOURCE_WEEK + 1
+
+
+def test_each_manager_has_its_own_assign_table_per_week(client, db):
+    db["tables"].insert_one(make_assign_table("TA002", OTHER_MANAGER))
+    db["counters"].update_one({"_id": "table_id_TA"}, {"$set": {"seq": 2}})
+
+    # Tuần đích đã có assign table của cửa hàng khác, không ảnh hưởng cửa hàng này
+    assert client.post(f"/tables/copy_assign_table/{SOURCE_WEEK}/",
+                       headers=manager_headers("boss2")).status_code == 201
+    assert client.post(f"/tables/copy_assign_table/{SOURCE_WEEK}/",
+                       headers=manager_headers()).status_code == 201
+    copies = db["tables"].find({"table_type": "assign", "week": SOURCE_WEEK + 1})
+    assert sorted(copy["user_details"]["username"] for copy in copies) == ["boss1", "boss2"]
+
+
+def test_unique_index_rejects_racing_merge(db):
+    # Hai request đều qua bước kiểm tra trước; $merge thứ hai phải bị unique index chặn
+    db["tables"].aggregate(build_copy_assign_pipeline(
+        SOURCE_WEEK, 1, YEAR, "TA100", MANAGER, False))
+    with pytest.raises(DuplicateKeyError):
+        db["tables"].aggregate(build_copy_assign_pipeline(
+            SOURCE_WEEK, 1, YEAR, "TA101", MANAGER, False))
+    assert db["tables"].count_documents({"table_type": "assign", "week": SOURCE_WEEK + 1}) == 1
+
+
+def test_target_week_past_year_end_is_rejected(client, db):
+    db["tables"].update_one({"table_id": "TA001"}, {"$set": {"week": 52}})
+
+    response = client.post(
+        "/tables/copy_assign_table/52/?offset=2", headers=manager_headers())
+
+    assert response.status_code == 400
+    assert db["tables"].count_documents({"table_type": "assign"}) == 1